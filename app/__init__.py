@@ -48,10 +48,16 @@ def create_app():
     db.init_app(app)
     mail.init_app(app)
     CORS(app, supports_credentials=True)
-    JWTManager(app)
+    jwt = JWTManager(app)
     socketio.init_app(app)
 
     from .routes import main
     app.register_blueprint(main)
+    from .commands import register_commands
+    register_commands(app)
+    from .moderation import moderation_queue
+    moderation_queue.init_app(app)
+    from .revocation import token_revocation
+    token_revocation.init_app(app, jwt)
     from . import socket_events
     return app
\ No newline at end of file
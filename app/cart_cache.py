@@ -0,0 +1,174 @@
+import os
+import threading
+
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+
+from . import db
+from .cache import TTLCache
+from .models import CartItem, Product
+
+CART_CACHE_SIZE = int(os.getenv("CART_CACHE_SIZE", 5000))
+# Cache nằm trong từng process; TTL giới hạn thời gian lệch giữa các worker
+CART_CACHE_TTL = int(os.getenv("CART_CACHE_TTL", 300))
+CART_BATCH_MAX_OPERATIONS = int(os.getenv("CART_BATCH_MAX_OPERATIONS", 200))
+
+
+def collapse_cart_operations(operations):
+    """
+    Gộp danh sách thao tác add / set / remove theo thứ tự thành 1 thao tác cuối cùng cho mỗi
+    sản phẩm: {product_id: ("add", n) | ("set", n) | ("remove", None)}. Dữ liệu sai -> ValueError.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise ValueError("Danh sách thao tác không hợp lệ")
+    if len(operations) > CART_BATCH_MAX_OPERATIONS:
+        raise ValueError(f"Tối đa {CART_BATCH_MAX_OPERATIONS} thao tác mỗi lần")
+
+    final = {}
+    for index, op in enumerate(operations):
+        try:
+            kind = op["op"]
+            product_id = int(op["product_id"])
+            quantity = int(op.get("quantity", 1)) if kind != "remove" else None
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"Thao tác thứ {index + 1} không hợp lệ")
+        if kind not in ["add", "set", "remove"]:
+            raise ValueError(f"Thao tác thứ {index + 1} không hợp lệ: {kind}")
+        if kind == "add" and quantity < 1:
+            raise ValueError(f"Thao tác thứ {index + 1}: số lượng phải lớn hơn 0")
+
+        previous = final.get(product_id)
+        if kind == "add" and previous:
+            if previous[0] == "remove":
+                kind = "set"
+            else:
+                kind, quantity = previous[0], previous[1] + quantity
+        if kind == "set" and quantity <= 0:
+            kind, quantity = "remove", None
+        final[product_id] = (kind, quantity)
+    return final
+
+
+class CartCache:
+    """
+    Giỏ hàng của từng user giữ trong bộ nhớ: {product_id: {"id": cart_item_id, "quantity": n}}.
+    Mọi thay đổi ghi thẳng xuống cart_items rồi cập nhật cache (write-through);
+    user không hoạt động bị đẩy ra theo LRU / TTL.
+    """
+
+    def __init__(self, maxsize=CART_CACHE_SIZE, ttl=CART_CACHE_TTL):
+        self._carts = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        # Mỗi lần ghi lấy 1 số thứ tự tăng dần và nhớ số của lần ghi cuối cho từng user; lần nạp từ DB
+        # chỉ được lưu nếu không có lần ghi nào sau lúc bắt đầu đọc. Chỉ cần nhớ đủ lâu để bao trùm
+        # 1 lần đọc nên giữ trong TTLCache có giới hạn, không phình theo số user
+        self._write_seq = 0
+        self._last_writes = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def _bump(self, user_id):
+        self._write_seq += 1
+        self._last_writes.set(user_id, self._write_seq)
+
+    def lines(self, user_id):
+        user_id = int(user_id)
+        with self._lock:
+            cart = self._carts.get(user_id)
+            if cart is not None:
+                return {pid: dict(line) for pid, line in cart.items()}
+            started_seq = self._write_seq
+        rows = db.session.query(CartItem.id, CartItem.product_id, CartItem.quantity) \
+            .filter(CartItem.user_id == user_id).all()
+        cart = {product_id: {"id": item_id, "quantity": quantity} for item_id, product_id, quantity in rows}
+        with self._lock:
+            if self._last_writes.get(user_id, 0) <= started_seq:
+                self._carts.set(user_id, cart)
+        return {pid: dict(line) for pid, line in cart.items()}
+
+    def _update(self, user_id, fn):
+        # Chỉ sửa khi giỏ đang có trong cache, chưa có thì lần đọc sau tự nạp từ DB
+        with self._lock:
+            self._bump(int(user_id))
+            cart = self._carts.get(int(user_id))
+            if cart is not None:
+                fn(cart)
+
+    def add(self, user_id, product_id, quantity):
+        """Cộng thêm số lượng (upsert theo unique (user_id, product_id)), commit rồi cập nhật cache."""
+        stmt = mysql_insert(CartItem).values(user_id=user_id, product_id=product_id, quantity=quantity)
+        db.session.execute(stmt.on_duplicate_key_update(quantity=CartItem.quantity + stmt.inserted.quantity))
+        db.session.commit()
+        row = db.session.query(CartItem.id, CartItem.quantity) \
+            .filter_by(user_id=user_id, product_id=product_id).first()
+        if row:
+            self._update(user_id, lambda cart: cart.__setitem__(product_id, {"id": row[0], "quantity": row[1]}))
+
+    def set_quantity(self, user_id, product_id, quantity):
+        updated = CartItem.query.filter_by(user_id=user_id, product_id=product_id) \
+            .update({CartItem.quantity: quantity}, synchronize_session=False)
+        db.session.commit()
+        if not updated:
+            return False
+
+        def apply(cart):
+            if product_id in cart:
+                cart[product_id]["quantity"] = quantity
+            else:
+                self._carts.pop(int(user_id))
+        self._update(user_id, apply)
+        return True
+
+    def remove_item(self, user_id, item_id):
+        deleted = CartItem.query.filter_by(id=item_id, user_id=user_id).delete(synchronize_session=False)
+        db.session.commit()
+        if not deleted:
+            return False
+
+        def apply(cart):
+            for product_id, line in list(cart.items()):
+                if line["id"] == item_id:
+                    del cart[product_id]
+        self._update(user_id, apply)
+        return True
+
+    def apply_batch(self, user_id, final):
+        """
+        Áp các thao tác đã gộp trong 1 transaction: 1 DELETE cho các dòng bị xóa, 1 upsert ghi đè
+        số lượng cho "set", 1 upsert cộng dồn cho "add". Trả về các product_id không tồn tại (bị bỏ qua).
+        """
+        wanted = [pid for pid, (kind, _) in final.items() if kind != "remove"]
+        existing = {pid for (pid,) in db.session.query(Product.id).filter(Product.id.in_(wanted)).all()} \
+            if wanted else set()
+        skipped = sorted(set(wanted) - existing)
+
+        removes = [pid for pid, (kind, _) in final.items() if kind == "remove"]
+        sets = [{"user_id": user_id, "product_id": pid, "quantity": q}
+                for pid, (kind, q) in final.items() if kind == "set" and pid in existing]
+        adds = [{"user_id": user_id, "product_id": pid, "quantity": q}
+                for pid, (kind, q) in final.items() if kind == "add" and pid in existing]
+        try:
+            if removes:
+                CartItem.query.filter(CartItem.user_id == user_id, CartItem.product_id.in_(removes)) \
+                    .delete(synchronize_session=False)
+            if sets:
+                stmt = mysql_insert(CartItem).values(sets)
+                db.session.execute(stmt.on_duplicate_key_update(quantity=stmt.inserted.quantity))
+            if adds:
+                stmt = mysql_insert(CartItem).values(adds)
+                db.session.execute(stmt.on_duplicate_key_update(quantity=CartItem.quantity + stmt.inserted.quantity))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            self.invalidate(user_id)
+        return skipped
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._bump(int(user_id))
+            self._carts.pop(int(user_id))
+
+    def stats(self):
+        return self._carts.stats()
+
+
+cart_cache = CartCache()
@@ -0,0 +1,148 @@
+import os
+
+from sqlalchemy import event, inspect
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.orm import Session
+
+from . import db
+from .cache import TTLCache
+from .models import Brand, CatalogVersion, Category, Product
+from .retrieval import ProductIndex
+
+# Phiên bản catalog đọc lại từ DB sau mỗi khoảng này, để thay đổi từ worker khác được thấy
+CATALOG_VERSION_TTL = int(os.getenv("CATALOG_VERSION_TTL", 5))
+CHATBOT_CONTEXT_PRODUCTS = int(os.getenv("CHATBOT_CONTEXT_PRODUCTS", 30))
+# Số sản phẩm liên quan nhất đưa vào prompt cho mỗi câu hỏi
+CHATBOT_TOP_K = int(os.getenv("CHATBOT_TOP_K", 8))
+
+# Các cột có mặt trong ngữ cảnh chatbot; đổi tồn kho, điểm đánh giá... không làm đổi phiên bản
+CATALOG_COLUMNS = {
+    Product: {"name", "price", "category_id", "brand_id", "cpu", "ram", "storage", "screen", "battery", "color"},
+    Brand: {"name"},
+    Category: {"name"},
+}
+
+_version_cache = TTLCache(maxsize=1, ttl=CATALOG_VERSION_TTL)
+_context_cache = TTLCache(maxsize=4)
+_index_cache = TTLCache(maxsize=2)
+
+
+def _catalog_changed(session):
+    for obj in list(session.new) + list(session.deleted):
+        if type(obj) in CATALOG_COLUMNS:
+            return True
+    for obj in session.dirty:
+        columns = CATALOG_COLUMNS.get(type(obj))
+        if columns:
+            state = inspect(obj)
+            if any(state.attrs[c].history.has_changes() for c in columns):
+                return True
+    return False
+
+
+@event.listens_for(Session, "before_flush")
+def _mark_catalog_change(session, flush_context, instances):
+    if _catalog_changed(session):
+        session.info["catalog_changed"] = True
+
+
+@event.listens_for(Session, "after_flush")
+def _bump_catalog_version(session, flush_context):
+    if not session.info.pop("catalog_changed", False):
+        return
+    # Tăng phiên bản trong cùng transaction với thay đổi catalog; 1 câu upsert để lần tăng đầu tiên
+    # từ 2 worker cùng lúc không đụng nhau ở INSERT
+    stmt = mysql_insert(CatalogVersion).values(id=1, version=1)
+    session.connection().execute(stmt.on_duplicate_key_update(version=CatalogVersion.version + 1))
+    session.info["catalog_bumped"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _refresh_local_version(session):
+    # Worker thực hiện thay đổi thấy phiên bản mới ngay, không chờ hết TTL
+    if session.info.pop("catalog_bumped", False):
+        _version_cache.clear()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_catalog_flags(session):
+    session.info.pop("catalog_changed", None)
+    session.info.pop("catalog_bumped", None)
+
+
+def catalog_version():
+    version = _version_cache.get("version")
+    if version is None:
+        version = db.session.query(CatalogVersion.version).filter(CatalogVersion.id == 1).scalar() or 0
+        _version_cache.set("version", version)
+    return version
+
+
+def _catalog_rows(limit=None):
+    query = (
+        db.session.query(
+            Product.name, Category.name, Brand.name, Product.price, Product.ram, Product.cpu,
+            Product.storage, Product.screen, Product.battery, Product.color,
+        )
+        .join(Brand, Brand.id == Product.brand_id)
+        .join(Category, Category.id == Product.category_id)
+        .order_by(Product.id)
+    )
+    if limit:
+        query = query.limit(limit)
+    return query.all()
+
+
+def _format_product(row):
+    name, category, brand, price, ram, cpu, storage, screen, battery, color = row
+    return (
+        f"- {name} ({category or 'Không rõ'} - {brand or 'Không rõ'}): "
+        f"Giá {price:,.0f}₫, RAM {ram}, CPU {cpu}, bộ nhớ {storage}, "
+        f"màn hình {screen}, pin {battery}, màu {color}."
+    )
+
+
+def _build_product_context():
+    return "\n".join(_format_product(row) for row in _catalog_rows(CHATBOT_CONTEXT_PRODUCTS))
+
+
+def product_context():
+    """Chuỗi ngữ cảnh sản phẩm cho chatbot, chỉ dựng lại khi phiên bản catalog thay đổi."""
+    version = catalog_version()
+    context = _context_cache.get(version)
+    if context is None:
+        context = _build_product_context()
+        _context_cache.set(version, context)
+    return context
+
+
+class CatalogIndex:
+    """Chỉ mục tìm kiếm + dòng mô tả đã định dạng của toàn bộ catalog ở 1 phiên bản."""
+
+    def __init__(self, rows):
+        self.lines = [_format_product(row) for row in rows]
+        self.index = ProductIndex([
+            " ".join(str(value) for value in row if value is not None and not isinstance(value, float))
+            for row in rows
+        ])
+
+    def context_for(self, question, k=CHATBOT_TOP_K):
+        return "\n".join(self.lines[i] for i, _ in self.index.search(question, k))
+
+
+def catalog_index():
+    version = catalog_version()
+    index = _index_cache.get(version)
+    if index is None:
+        index = CatalogIndex(_catalog_rows())
+        _index_cache.set(version, index)
+    return index
+
+
+def relevant_product_context(question):
+    """
+    Ngữ cảnh cho 1 câu hỏi: top-k sản phẩm liên quan nhất theo chỉ mục n-gram; câu hỏi không
+    khớp sản phẩm nào (chào hỏi, chính sách...) thì dùng ngữ cảnh chung đã cache.
+    """
+    context = catalog_index().context_for(question)
+    return context or product_context()
@@ -0,0 +1,114 @@
+import os
+import re
+import threading
+
+from .cache import TTLCache
+from .catalog import catalog_index, catalog_version
+from .utils import normalize_text
+
+SHOP_ADDRESS = "35c đường 109, Phước Long B, Quận 9, TP.HCM"
+SHOP_WARRANTY = "12 tháng tiêu chuẩn, đổi mới 7 ngày nếu lỗi nhà sản xuất"
+SHOP_HOTLINE = "0123456789"
+
+CHATBOT_CACHE_SIZE = int(os.getenv("CHATBOT_CACHE_SIZE", 2000))
+CHATBOT_CACHE_TTL = int(os.getenv("CHATBOT_CACHE_TTL", 3600))
+CHATBOT_FAQ_ENABLED = os.getenv("CHATBOT_FAQ_ENABLED", "1") != "0"
+# Câu dài hơn thì thường hỏi kèm ý khác -> để model trả lời
+FAQ_MAX_WORDS = int(os.getenv("CHATBOT_FAQ_MAX_WORDS", 10))
+# Câu hỏi khớp một sản phẩm với điểm từ mức này trở lên thì không trả lời bằng FAQ
+FAQ_PRODUCT_MIN_SCORE = float(os.getenv("CHATBOT_FAQ_PRODUCT_MIN_SCORE", 0.35))
+# Chỉ cache câu trả lời khi câu hỏi khớp sản phẩm từ mức này (câu xã giao thường < 0.15)
+CACHE_PRODUCT_MIN_SCORE = float(os.getenv("CHATBOT_CACHE_PRODUCT_MIN_SCORE", 0.2))
+
+# Lời gọi / hỏi lịch sự ở đầu và cuối câu, vd "shop ơi cho mình hỏi ... vậy ạ"
+_FAQ_PREFIX = r"^((shop|ad) oi )?(cho (minh |em |toi )?hoi )?"
+_FAQ_SUFFIX = r"( (vay|a|the|nhi|nhe|shop|ad|oi|ha))*$"
+
+# So khớp nguyên câu trên văn bản đã chuẩn hóa (chữ thường, bỏ dấu); câu có ý khác đi kèm để model trả lời
+FAQ_INTENTS = [
+    (
+        re.compile(r"^(xin )?chao( (ban|shop|ad|admin|em|anh|chi))?$|^(hi|hello|alo)( shop)?$"),
+        "Xin chào! Mình là trợ lý của PhuStore, bạn cần tư vấn sản phẩm nào ạ?",
+    ),
+    (
+        re.compile(
+            _FAQ_PREFIX
+            + r"(dia chi( (cua )?(shop|cua hang))?( (o dau|la gi))?|(shop|cua hang)( nam)?( o)? dau)"
+            + _FAQ_SUFFIX
+        ),
+        f"Cửa hàng PhuStore ở địa chỉ: {SHOP_ADDRESS}. Rất hân hạnh được đón tiếp bạn!",
+    ),
+    (
+        re.compile(
+            _FAQ_PREFIX
+            + r"(chinh sach )?(bao hanh|doi tra|doi moi)( (cua )?(shop|cua hang))?"
+            + r"( (the nao|nhu the nao|ra sao|bao lau|may thang))?"
+            + _FAQ_SUFFIX
+        ),
+        f"Chính sách bảo hành của PhuStore: {SHOP_WARRANTY}.",
+    ),
+    (
+        re.compile(
+            _FAQ_PREFIX
+            + r"(hotline|so dien thoai|sdt|lien he)( (cua )?(shop|cua hang))?"
+            + r"( (la gi|la bao nhieu|bao nhieu|the nao|o dau))?"
+            + _FAQ_SUFFIX
+        ),
+        f"Bạn có thể liên hệ hotline PhuStore: {SHOP_HOTLINE}.",
+    ),
+]
+
+
+class ChatResponseCache:
+    """
+    Cache câu trả lời chatbot cho câu hỏi về sản phẩm, theo câu hỏi đã chuẩn hóa + phiên bản catalog
+    (catalog đổi thì câu trả lời cũ về giá / sản phẩm tự hết hiệu lực). Kèm lối tắt FAQ trả lời ngay tại server.
+    """
+
+    def __init__(self, maxsize=CHATBOT_CACHE_SIZE, ttl=CHATBOT_CACHE_TTL):
+        self._replies = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self.faq_hits = 0
+
+    def faq_answer(self, normalized):
+        if not CHATBOT_FAQ_ENABLED or not normalized or len(normalized.split()) > FAQ_MAX_WORDS:
+            return None
+        for pattern, answer in FAQ_INTENTS:
+            if pattern.search(normalized):
+                # Có nhắc tới sản phẩm cụ thể thì để model trả lời theo ngữ cảnh sản phẩm
+                if catalog_index().index.search(normalized, 1, min_score=FAQ_PRODUCT_MIN_SCORE):
+                    return None
+                with self._lock:
+                    self.faq_hits += 1
+                return answer
+        return None
+
+    def lookup(self, message):
+        """Trả về câu trả lời có sẵn (FAQ hoặc cache), None nếu phải hỏi model."""
+        normalized = normalize_text(message)
+        answer = self.faq_answer(normalized)
+        if answer:
+            return answer
+        return self._replies.get((catalog_version(), normalized))
+
+    def store(self, message, reply):
+        """Lưu câu trả lời về sản phẩm; câu khác (vd "hôm nay ngày mấy") phụ thuộc lúc hỏi nên không lưu."""
+        normalized = normalize_text(message)
+        if not catalog_index().index.search(normalized, 1, min_score=CACHE_PRODUCT_MIN_SCORE):
+            return False
+        self._replies.set((catalog_version(), normalized), reply)
+        return True
+
+    def stats(self):
+        replies = self._replies.stats()
+        return {
+            "size": replies["size"],
+            "maxsize": replies["maxsize"],
+            "hits": replies["hits"],
+            "misses": replies["misses"],
+            "hit_rate": replies["hit_rate"],
+            "faq_hits": self.faq_hits,
+        }
+
+
+chat_response_cache = ChatResponseCache()
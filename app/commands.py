@@ -0,0 +1,88 @@
+import click
+
+from .forecast import run_inventory_forecast
+from .moderation import moderation_queue
+from .purchases import rebuild_purchase_index
+from .ratings import rebuild_rating_summaries
+from .revocation import token_revocation
+from .snapshot import SNAPSHOT_DIR, SNAPSHOT_KEEP, write_order_snapshot
+from .stats import rebuild_daily_sales, rebuild_product_sales
+from .votes import backfill_comment_voters, reconcile_comment_likes
+
+
+def register_commands(app):
+    @app.cli.command("snapshot-orders")
+    @click.option("--out", default=SNAPSHOT_DIR, show_default=True, help="Thư mục chứa snapshot")
+    @click.option("--keep", default=SNAPSHOT_KEEP, show_default=True, type=int,
+                  help="Số thế hệ mới nhất giữ lại, 0 = giữ tất cả")
+    def snapshot_orders(out, keep):
+        """Ghi snapshot dạng cột của orders/order_items cho phân tích offline."""
+        generation = write_order_snapshot(out, keep=keep)
+        tables = generation["tables"]
+        click.echo(
+            f"Đã ghi snapshot {generation['name']}: "
+            f"{tables['orders']['rows']} đơn hàng, {tables['order_items']['rows']} dòng sản phẩm"
+        )
+
+    @app.cli.command("rebuild-sales-series")
+    def rebuild_sales_series():
+        """Tính lại bảng daily_sales từ toàn bộ đơn đã thanh toán."""
+        rows = rebuild_daily_sales()
+        click.echo(f"Đã ghi {rows} dòng daily_sales")
+
+    @app.cli.command("rebuild-product-sales")
+    def rebuild_product_sales_command():
+        """Tính lại bộ đếm số lượng bán theo kỳ của từng sản phẩm."""
+        rows = rebuild_product_sales()
+        click.echo(f"Đã ghi {rows} dòng product_sales")
+
+    @app.cli.command("forecast-inventory")
+    def forecast_inventory():
+        """Dự báo tốc độ bán, điểm đặt hàng lại và ngày hết hàng cho toàn bộ sản phẩm."""
+        count = run_inventory_forecast()
+        click.echo(f"Đã dự báo tồn kho cho {count} sản phẩm")
+
+    @app.cli.command("rebuild-ratings")
+    def rebuild_ratings():
+        """Tính lại số lượt, tổng điểm và phân bố sao của mọi sản phẩm từ bảng comments."""
+        count = rebuild_rating_summaries()
+        click.echo(f"Đã cập nhật đánh giá cho {count} sản phẩm")
+
+    @app.cli.command("reconcile-comment-likes")
+    @click.option("--dry-run", is_flag=True, help="Chỉ báo cáo, không sửa")
+    def reconcile_comment_likes_command(dry_run):
+        """Đối soát bộ đếm like của bình luận với bảng comment_votes (chạy định kỳ bằng cron)."""
+        mismatches = reconcile_comment_likes(fix=not dry_run)
+        for comment_id, stored, real in mismatches:
+            click.echo(f"Bình luận {comment_id}: đang lưu {stored}, thực tế {real}")
+        click.echo(f"{len(mismatches)} bình luận bị lệch" + ("" if dry_run else ", đã sửa"))
+
+    @app.cli.command("moderate-pending")
+    @click.option("--min-age", default=0, show_default=True, type=float,
+                  help="Chỉ duyệt bình luận chờ lâu hơn số giây này")
+    def moderate_pending(min_age):
+        """Duyệt các bình luận còn PENDING (chạy định kỳ bằng cron khi MODERATION_BACKGROUND=0)."""
+        done, failed = moderation_queue.moderate_pending(min_age)
+        click.echo(f"Đã duyệt {done} bình luận, {failed} bình luận lỗi (vẫn PENDING)")
+
+    @app.cli.command("backfill-comment-voters")
+    def backfill_comment_voters_command():
+        """Điền cột voter cho vote cũ, xóa vote trùng, tạo unique (comment_id, voter) rồi đối soát lại số like."""
+        filled, duplicates = backfill_comment_voters()
+        mismatches = reconcile_comment_likes(fix=True)
+        click.echo(
+            f"Đã điền voter cho {filled} vote, xóa {duplicates} vote trùng, "
+            f"sửa số like của {len(mismatches)} bình luận"
+        )
+
+    @app.cli.command("rebuild-purchase-index")
+    def rebuild_purchase_index_command():
+        """Dựng lại bảng (người mua, sản phẩm) dùng để kiểm tra quyền đánh giá."""
+        count = rebuild_purchase_index()
+        click.echo(f"purchase_index có {count} dòng")
+
+    @app.cli.command("purge-revoked-tokens")
+    def purge_revoked_tokens():
+        """Xóa các dòng thu hồi token đã quá hạn."""
+        deleted = token_revocation.purge_expired()
+        click.echo(f"Đã xóa {deleted} dòng revoked_tokens hết hạn")
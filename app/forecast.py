@@ -0,0 +1,130 @@
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import func
+
+from . import db
+from .models import InventoryForecast, Order, OrderItem, OrderStatus, Product, StockIn
+
+HISTORY_DAYS = int(os.getenv("FORECAST_HISTORY_DAYS", 90))
+LEAD_TIME_DAYS = float(os.getenv("FORECAST_LEAD_TIME_DAYS", 7))
+SERVICE_LEVEL_Z = float(os.getenv("FORECAST_SERVICE_LEVEL_Z", 1.65))  # ~95% không hết hàng
+DEFAULT_CYCLE_DAYS = float(os.getenv("FORECAST_CYCLE_DAYS", 30))
+# Số ngày quan sát tối thiểu khi tính tốc độ bán, để sản phẩm mới nhập không bị thổi phồng tốc độ
+MIN_OBSERVED_DAYS = max(1, min(int(os.getenv("FORECAST_MIN_OBSERVED_DAYS", 14)), HISTORY_DAYS))
+
+
+def _to_date(value):
+    # MySQL trả về date, một số driver khác trả về chuỗi
+    if isinstance(value, str):
+        return datetime.strptime(value[:10], "%Y-%m-%d").date()
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+def run_inventory_forecast(today=None):
+    """
+    Dự báo tồn kho cho toàn bộ catalog trong 1 lượt NumPy:
+    - chuỗi số lượng bán theo ngày (sản phẩm x ngày) lấy từ OrderItem của đơn PAID
+    - tốc độ bán, độ lệch chuẩn, điểm đặt hàng lại có tính lead time
+    - chu kỳ nhập hàng ước lượng từ lịch sử StockIn
+    """
+    today = today or datetime.now().date()
+    start = today - timedelta(days=HISTORY_DAYS - 1)
+
+    products = db.session.query(Product.id, Product.stock).order_by(Product.id).all()
+    if not products:
+        return 0
+    product_ids = np.array([p[0] for p in products], dtype=np.int64)
+    stock = np.array([p[1] or 0 for p in products], dtype=np.float64)
+    n = len(product_ids)
+
+    # ===== Chuỗi bán hàng theo ngày =====
+    day = func.date(Order.created_at)
+    sales = (
+        db.session.query(OrderItem.product_id, day, func.sum(OrderItem.quantity))
+        .join(Order, Order.id == OrderItem.order_id)
+        .filter(Order.status == OrderStatus.PAID, Order.created_at >= start)
+        .group_by(OrderItem.product_id, day)
+        .all()
+    )
+    units = np.zeros((n, HISTORY_DAYS), dtype=np.float64)
+    first_sale = np.full(n, HISTORY_DAYS, dtype=np.int64)  # chỉ số ngày bán đầu tiên trong cửa sổ
+    if sales:
+        sale_pids = np.array([r[0] for r in sales], dtype=np.int64)
+        sale_days = np.array([(_to_date(r[1]) - start).days for r in sales], dtype=np.int64)
+        sale_qty = np.array([float(r[2] or 0) for r in sales], dtype=np.float64)
+        rows = np.searchsorted(product_ids, sale_pids)
+        valid = (rows < n) & (sale_days >= 0) & (sale_days < HISTORY_DAYS)
+        valid[valid] &= product_ids[rows[valid]] == sale_pids[valid]
+        np.add.at(units, (rows[valid], sale_days[valid]), sale_qty[valid])
+        np.minimum.at(first_sale, rows[valid], sale_days[valid])
+
+    # ===== Lịch sử nhập kho: ngày nhập đầu tiên và chu kỳ nhập =====
+    stock_ins = (
+        db.session.query(StockIn.product_id, func.min(StockIn.date), func.max(StockIn.date), func.count(StockIn.id))
+        .group_by(StockIn.product_id)
+        .all()
+    )
+    cycle_days = np.full(n, DEFAULT_CYCLE_DAYS, dtype=np.float64)
+    # Mặc định tính trên cả cửa sổ; chỉ rút ngắn khi có ngày nhập kho đầu tiên làm bằng chứng
+    first_seen = np.zeros(n, dtype=np.int64)
+    if stock_ins:
+        in_pids = np.array([r[0] for r in stock_ins], dtype=np.int64)
+        first_in = np.array([(_to_date(r[1]) - start).days for r in stock_ins], dtype=np.int64)
+        span = np.array([(_to_date(r[2]) - _to_date(r[1])).days for r in stock_ins], dtype=np.float64)
+        count = np.array([r[3] for r in stock_ins], dtype=np.float64)
+        rows = np.searchsorted(product_ids, in_pids)
+        valid = rows < n
+        valid[valid] &= product_ids[rows[valid]] == in_pids[valid]
+        rows, first_in, span, count = rows[valid], first_in[valid], span[valid], count[valid]
+        # Bán trước ngày nhập đầu tiên (hàng tồn cũ chưa ghi StockIn) thì tính từ ngày bán đó
+        first_seen[rows] = np.minimum(np.maximum(first_in, 0), first_sale[rows])
+        has_cycle = count >= 2
+        cycle_days[rows[has_cycle]] = span[has_cycle] / (count[has_cycle] - 1)
+
+    first_seen = np.minimum(first_seen, HISTORY_DAYS - MIN_OBSERVED_DAYS)
+
+    # ===== Thống kê vector hóa =====
+    day_index = np.arange(HISTORY_DAYS)
+    mask = day_index[None, :] >= first_seen[:, None]
+    observed = mask.sum(axis=1).astype(np.float64)
+    velocity = (units * mask).sum(axis=1) / observed
+    deviation = (units - velocity[:, None]) * mask
+    variance = (deviation ** 2).sum(axis=1) / np.maximum(observed - 1, 1)
+    velocity_std = np.sqrt(variance)
+
+    safety_stock = SERVICE_LEVEL_Z * velocity_std * np.sqrt(LEAD_TIME_DAYS)
+    reorder_point = velocity * LEAD_TIME_DAYS + safety_stock
+    selling = velocity > 0
+    days_of_cover = np.where(selling, stock / np.where(selling, velocity, 1), np.nan)
+    needs_reorder = selling & (stock <= reorder_point)
+    # Đặt đủ hàng cho lead time + 1 chu kỳ nhập, cộng tồn kho an toàn
+    order_up_to = velocity * (LEAD_TIME_DAYS + cycle_days) + safety_stock
+    suggested = np.where(needs_reorder, np.ceil(np.maximum(order_up_to - stock, 0)), 0)
+
+    computed_at = datetime.now()
+    rows = []
+    for i in range(n):
+        cover = None if np.isnan(days_of_cover[i]) else float(days_of_cover[i])
+        rows.append({
+            "product_id": int(product_ids[i]),
+            "stock": float(stock[i]),
+            "velocity": float(velocity[i]),
+            "velocity_std": float(velocity_std[i]),
+            "observed_days": int(observed[i]),
+            "safety_stock": float(safety_stock[i]),
+            "reorder_point": float(reorder_point[i]),
+            "days_of_cover": cover,
+            "stockout_date": today + timedelta(days=int(cover)) if cover is not None and cover < 3650 else None,
+            "suggested_quantity": int(suggested[i]),
+            "needs_reorder": bool(needs_reorder[i]),
+            "computed_at": computed_at,
+        })
+
+    InventoryForecast.query.delete()
+    db.session.bulk_insert_mappings(InventoryForecast, rows)
+    db.session.commit()
+    return n
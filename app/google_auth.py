@@ -0,0 +1,122 @@
+import base64
+import json
+import os
+import re
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from google.auth import jwt as google_jwt
+
+# Có thể trỏ sang endpoint chứng chỉ giả lập chạy local khi test
+GOOGLE_CERTS_URL = os.getenv("GOOGLE_CERTS_URL", "https://www.googleapis.com/oauth2/v1/certs")
+GOOGLE_ISSUERS = ["accounts.google.com", "https://accounts.google.com"]
+GOOGLE_CERTS_TIMEOUT = float(os.getenv("GOOGLE_CERTS_TIMEOUT", 5))
+# Dùng khi response không có Cache-Control max-age
+GOOGLE_CERTS_DEFAULT_MAX_AGE = int(os.getenv("GOOGLE_CERTS_DEFAULT_MAX_AGE", 300))
+# Làm mới ngầm khi còn chừng này giây là hết hạn, request không phải chờ tải chứng chỉ
+GOOGLE_CERTS_REFRESH_MARGIN = int(os.getenv("GOOGLE_CERTS_REFRESH_MARGIN", 60))
+# Token có kid lạ chỉ được ép tải lại chứng chỉ tối đa 1 lần trong khoảng này
+GOOGLE_CERTS_MIN_REFRESH_INTERVAL = int(os.getenv("GOOGLE_CERTS_MIN_REFRESH_INTERVAL", 30))
+GOOGLE_CLOCK_SKEW = int(os.getenv("GOOGLE_CLOCK_SKEW", 10))
+
+_max_age_pattern = re.compile(r"max-age=(\d+)")
+
+
+class GoogleCertsUnavailable(Exception):
+    pass
+
+
+class GoogleCertCache:
+    """Giữ chứng chỉ ký token của Google theo thời hạn cache HTTP, tải lại qua 1 session dùng chung."""
+
+    def __init__(self, url=GOOGLE_CERTS_URL):
+        self.url = url
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        self._certs = None
+        self._expires_at = 0
+        self._fetched_at = 0
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self.fetches = 0
+
+    def _fetch(self):
+        try:
+            res = self.session.get(self.url, timeout=GOOGLE_CERTS_TIMEOUT)
+            res.raise_for_status()
+            certs = res.json()
+        except Exception as e:
+            raise GoogleCertsUnavailable(str(e))
+
+        match = _max_age_pattern.search(res.headers.get("Cache-Control", ""))
+        max_age = int(match.group(1)) if match else GOOGLE_CERTS_DEFAULT_MAX_AGE
+        try:
+            max_age -= int(res.headers.get("Age", 0))
+        except ValueError:
+            pass
+        self._certs = certs
+        self._fetched_at = time.monotonic()
+        self._expires_at = self._fetched_at + max(max_age, 0)
+        self.fetches += 1
+        return certs
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                with self._lock:
+                    self._fetch()
+            except GoogleCertsUnavailable as e:
+                # Giữ bộ chứng chỉ cũ tới khi hết hạn hẳn
+                print("Google certs refresh error:", e)
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name="google-certs-refresh", daemon=True).start()
+
+    def get(self, force=False):
+        now = time.monotonic()
+        if not force and self._certs is not None and now < self._expires_at:
+            if now > self._expires_at - GOOGLE_CERTS_REFRESH_MARGIN:
+                self._refresh_in_background()
+            return self._certs
+        with self._lock:
+            # Request khác có thể vừa tải xong trong lúc chờ lock
+            now = time.monotonic()
+            if self._certs is not None and now < self._expires_at:
+                if not force or now - self._fetched_at < GOOGLE_CERTS_MIN_REFRESH_INTERVAL:
+                    return self._certs
+            return self._fetch()
+
+
+google_cert_cache = GoogleCertCache()
+
+
+def _token_key_id(token):
+    try:
+        header = token.split(".", 1)[0]
+        header += "=" * (-len(header) % 4)
+        return json.loads(base64.urlsafe_b64decode(header)).get("kid")
+    except Exception:
+        raise ValueError("Token không đúng định dạng")
+
+
+def verify_google_id_token(token, audience):
+    """Xác thực id_token của Google ngay tại server bằng chứng chỉ đã cache. Sai -> ValueError."""
+    certs = google_cert_cache.get()
+    kid = _token_key_id(token)
+    if kid and kid not in certs:
+        # Google vừa xoay khóa -> tải lại chứng chỉ 1 lần
+        certs = google_cert_cache.get(force=True)
+
+    idinfo = google_jwt.decode(token, certs=certs, audience=audience, clock_skew_in_seconds=GOOGLE_CLOCK_SKEW)
+    if idinfo.get("iss") not in GOOGLE_ISSUERS:
+        raise ValueError("Sai issuer")
+    return idinfo
@@ -1,5 +1,5 @@
 from backend.app import create_app, db
-from werkzeug.security import generate_password_hash, check_password_hash
+from backend.app.passwords import password_hasher
 from flask_login import UserMixin
 from datetime import datetime
 from sqlalchemy import Enum
@@ -26,10 +26,18 @@ class User(BaseModel, UserMixin):
     user = db.relationship("Order", backref="user", lazy=True)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
+
+    def upgrade_password_hash(self, password):
+        # Gọi sau khi đăng nhập đúng: băm lại nếu cấu hình băm đã đổi so với lúc lưu
+        new_hash = password_hasher.rehash_if_needed(self.password_hash, password)
+        if not new_hash:
+            return False
+        self.password_hash = new_hash
+        return True
 
 class Category(BaseModel):
     __tablename__ = "categories"
@@ -77,6 +85,25 @@ class Product(BaseModel):
     graphics_card = db.Column(db.String(200), nullable=True)  # card đồ họa (cho laptop)
     ports = db.Column(db.String(255), nullable=True)  # các cổng kết nối
     warranty = db.Column(db.String(100), nullable=True)
+    # Tổng hợp đánh giá, cập nhật cùng transaction khi thêm / xóa bình luận
+    rating_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_sum = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_1 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_2 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_3 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_4 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_5 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
+    @property
+    def average_rating(self):
+        return self.rating_sum / self.rating_count if self.rating_count else 0
+
+    def rating_summary(self):
+        return {
+            "average_rating": self.average_rating,
+            "rating_count": self.rating_count,
+            "rating_histogram": {str(star): getattr(self, f"rating_{star}") for star in range(1, 6)}
+        }
 
     def __str__(self):
         return self.name
@@ -136,7 +163,7 @@ class Order(BaseModel):
 
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)  # có thể là None
     guest_name = db.Column(db.String(100), nullable=True)   # tên khách vãng lai
-    guest_phone = db.Column(db.String(20), nullable=True)
+    guest_phone = db.Column(db.String(20), nullable=True, index=True)
     guest_email = db.Column(db.String(120),nullable =True)# SĐT khách vãng lai
     created_at = db.Column(db.DateTime, default=datetime.now)
     total_price = db.Column(db.Float, nullable=False)
@@ -153,6 +180,9 @@ class Order(BaseModel):
 
 class OrderItem(BaseModel):
     __tablename__ = "order_items"
+    __table_args__ = (
+        db.Index("ix_order_items_product_order", "product_id", "order_id"),
+    )
 
     order_id = db.Column(db.Integer, db.ForeignKey("orders.id"), nullable=False)
     product_id = db.Column(db.Integer, db.ForeignKey("products.id"), nullable=False)
@@ -161,8 +191,23 @@ class OrderItem(BaseModel):
     product = db.relationship("Product", lazy=True)
 
 
+class PurchaseIndex(BaseModel):
+    __tablename__ = "purchase_index"
+    __table_args__ = (
+        db.UniqueConstraint("buyer", "product_id", name="uq_purchase_index_buyer_product"),
+    )
+    # Ai đã đặt mua sản phẩm nào, dùng để kiểm tra quyền đánh giá bằng 1 lần tra cứu.
+    # buyer: "user:<user_id>" hoặc "phone:<guest_phone>"
+    buyer = db.Column(db.String(40), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey("products.id", ondelete="CASCADE"), nullable=False)
+
+
 class CartItem(BaseModel):
     __tablename__ = "cart_items"
+    __table_args__ = (
+        # Mỗi sản phẩm chỉ 1 dòng trong giỏ của 1 user, cũng là index cho tra cứu (user_id, product_id)
+        db.UniqueConstraint("user_id", "product_id", name="uq_cart_items_user_product"),
+    )
 
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
     product_id = db.Column(db.Integer, db.ForeignKey("products.id"), nullable=False)
@@ -172,8 +217,16 @@ class CartItem(BaseModel):
     product = db.relationship("Product")
 
 
+class CommentStatus(enum.Enum):
+    PENDING = "PENDING"    # Chờ duyệt
+    APPROVED = "APPROVED"  # Đã duyệt, hiển thị
+    REJECTED = "REJECTED"  # Nội dung không phù hợp
+
 class Comment(BaseModel):
     __tablename__ = "comments"
+    __table_args__ = (
+        db.Index("ix_comments_product_created", "product_id", "created_at", "id"),
+    )
 
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)  # null nếu khách
@@ -186,13 +239,22 @@ class Comment(BaseModel):
     admin_reply = db.Column(db.Text, nullable=True)
     reply_at = db.Column(db.DateTime, nullable=True)
     reply_role = db.Column(db.String(20), nullable=True)
+    # Bình luận mới chờ duyệt nền; server_default để các bình luận cũ vẫn hiển thị
+    status = db.Column(db.Enum(CommentStatus), default=CommentStatus.PENDING,
+                       server_default=CommentStatus.APPROVED.value, nullable=False)
     product = db.relationship('Product', backref=db.backref('comments', lazy=True))
     user = db.relationship('User', backref=db.backref('comments', lazy=True))
 
 class CommentVote(BaseModel):
     __tablename__ = "comment_votes"
+    __table_args__ = (
+        db.UniqueConstraint("comment_id", "voter", name="uq_comment_votes_voter"),
+    )
     comment_id = db.Column(db.Integer, db.ForeignKey("comments.id"), nullable=False)
 
+    # Định danh người vote: "user:<id>" hoặc "session:<session_id>", mỗi người chỉ vote 1 lần / comment
+    voter = db.Column(db.String(120), nullable=False)
+
     # Nếu user login thì dùng user_id
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
 
@@ -205,18 +267,27 @@ class CommentVote(BaseModel):
     user = db.relationship("User", backref="votes")
     comment = db.relationship("Comment", backref="votes")
 
-class OTP(BaseModel):
-    __tablename__ = "otps"
-    phone = db.Column(db.String(20), nullable=False)
-    otp_code = db.Column(db.String(6), nullable=False)
-    expiry = db.Column(db.DateTime, nullable=False)
+class ModerationVerdict(BaseModel):
+    __tablename__ = "moderation_verdicts"
+    # Kết quả duyệt của model, khóa theo hash nội dung đã chuẩn hóa
+    content_hash = db.Column(db.String(64), unique=True, nullable=False)
+    clean = db.Column(db.Boolean, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.now)
 
-    def is_valid(self, code):
-        return (
-            self.otp_code == code
-            and datetime.now() <= self.expiry
-        )
+class CatalogVersion(BaseModel):
+    __tablename__ = "catalog_versions"
+    # 1 dòng duy nhất (id=1), tăng mỗi khi sản phẩm / thương hiệu / danh mục thay đổi
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class RevokedToken(BaseModel):
+    __tablename__ = "revoked_tokens"
+    # key: "jti:<jti>" thu hồi 1 token, "user:<user_id>" thu hồi mọi token cấp trước revoked_before
+    key = db.Column(db.String(80), unique=True, nullable=False)
+    revoked_before = db.Column(db.DateTime, nullable=True)
+    # Sau thời điểm này token liên quan đã tự hết hạn, dòng có thể xóa
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    # Các worker đồng bộ bộ lọc theo cột này
+    created_at = db.Column(db.DateTime, default=datetime.now, index=True)
 
 class ExtraCost(BaseModel):
     __tablename__ = "extra_costs"
@@ -234,6 +305,53 @@ class SearchHistory(BaseModel):
 
     user = db.relationship("User", backref="searches")
 
+class DailySales(BaseModel):
+    __tablename__ = "daily_sales"
+    __table_args__ = (
+        db.UniqueConstraint("day", "brand_id", "category_id", name="uq_daily_sales_key"),
+    )
+    # Doanh số theo ngày, cộng dồn khi đơn chuyển sang PAID.
+    # brand_id / category_id = 0 nghĩa là "tất cả", nên mỗi đơn cập nhật 4 loại dòng:
+    # (0, 0), (brand, 0), (0, category), (brand, category)
+    day = db.Column(db.Date, nullable=False)
+    brand_id = db.Column(db.Integer, nullable=False, default=0)
+    category_id = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    units = db.Column(db.Integer, nullable=False, default=0)
+
+class ProductSales(BaseModel):
+    __tablename__ = "product_sales"
+    __table_args__ = (
+        db.UniqueConstraint("period", "bucket", "product_id", name="uq_product_sales_key"),
+        db.Index("ix_product_sales_period_category", "period", "bucket", "category_id"),
+    )
+    # Số lượng bán của từng sản phẩm theo kỳ ("day", "week", "month", "all").
+    # bucket là ngày đầu kỳ (ngày / thứ Hai / ngày 1 của tháng), kỳ "all" dùng 1970-01-01
+    product_id = db.Column(db.Integer, db.ForeignKey("products.id", ondelete="CASCADE"), nullable=False)
+    category_id = db.Column(db.Integer, nullable=False)
+    period = db.Column(db.String(10), nullable=False)
+    bucket = db.Column(db.Date, nullable=False)
+    units = db.Column(db.Integer, nullable=False, default=0)
+
+class InventoryForecast(BaseModel):
+    __tablename__ = "inventory_forecasts"
+    # Kết quả job dự báo tồn kho, mỗi sản phẩm 1 dòng, ghi đè sau mỗi lần chạy
+    product_id = db.Column(db.Integer, db.ForeignKey("products.id", ondelete="CASCADE"), unique=True, nullable=False)
+    stock = db.Column(db.Float, nullable=False)
+    velocity = db.Column(db.Float, nullable=False)  # số lượng bán trung bình / ngày
+    velocity_std = db.Column(db.Float, nullable=False)
+    observed_days = db.Column(db.Integer, nullable=False)
+    safety_stock = db.Column(db.Float, nullable=False)
+    reorder_point = db.Column(db.Float, nullable=False)
+    days_of_cover = db.Column(db.Float, nullable=True)  # None nếu không bán được
+    stockout_date = db.Column(db.Date, nullable=True)
+    suggested_quantity = db.Column(db.Integer, nullable=False, default=0)
+    needs_reorder = db.Column(db.Boolean, nullable=False, default=False)
+    computed_at = db.Column(db.DateTime, default=datetime.now)
+
+    product = db.relationship("Product")
+
 def seed_data(db):
     if not Category.query.first():
         phone = Category(name="Điện thoại")
@@ -0,0 +1,347 @@
+import hashlib
+import os
+import queue
+import re
+import threading
+import time
+import unicodedata
+from datetime import datetime, timedelta
+
+import click
+import requests
+
+from sqlalchemy import text
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+
+from . import db
+from .cache import TTLCache
+from .models import Comment, CommentStatus, ModerationVerdict
+from .ratings import update_rating_summary
+
+API_KEY = os.getenv("GOOGLE_API_KEY")
+MODEL_NAME = os.getenv("GOOGLE_MODEL_NAME")
+# Có thể trỏ sang một endpoint giả lập chạy local khi test
+MODERATION_ENDPOINT = os.getenv(
+    "MODERATION_ENDPOINT",
+    f"https://generativelanguage.googleapis.com/v1beta/models/{MODEL_NAME}:generateContent?key={API_KEY}"
+)
+MODERATION_TIMEOUT = float(os.getenv("MODERATION_TIMEOUT", 20))
+MODERATION_WORKERS = int(os.getenv("MODERATION_WORKERS", 2))
+MODERATION_MAX_RETRIES = int(os.getenv("MODERATION_MAX_RETRIES", 3))
+MODERATION_RETRY_DELAY = float(os.getenv("MODERATION_RETRY_DELAY", 5))
+# Chu kỳ quét lại bình luận còn PENDING (giây), <= 0 thì tắt
+MODERATION_SWEEP_INTERVAL = float(os.getenv("MODERATION_SWEEP_INTERVAL", 300))
+# Chỉ quét bình luận PENDING cũ hơn chừng này (giây), bình luận mới do worker nhận nó tự duyệt / thử lại
+MODERATION_SWEEP_MIN_AGE = float(os.getenv("MODERATION_SWEEP_MIN_AGE", 600))
+# Tắt (=0) thì web không chạy worker nền, bình luận chờ `flask moderate-pending` chạy bằng cron
+MODERATION_BACKGROUND = os.getenv("MODERATION_BACKGROUND", "1") != "0"
+# Khóa MySQL (GET_LOCK) để trong các process web chỉ 1 process giữ việc quét định kỳ
+SWEEP_LOCK_NAME = "phustore-moderation-sweep"
+VERDICT_CACHE_SIZE = int(os.getenv("MODERATION_VERDICT_CACHE_SIZE", 10000))
+
+# Từ ngữ chắc chắn không phù hợp -> chặn ngay, không cần gọi model.
+# So khớp trên chữ thường CÓ dấu để tránh bắt nhầm (vd "lớn" không phải "lồn")
+BANNED_WORDS = [
+    "địt", "đụ", "lồn", "cặc", "buồi", "đéo", "đĩ", "óc chó", "mẹ mày", "đồ chó",
+    "đm", "đmm", "dm", "dmm", "vcl", "vkl", "vl", "clm", "cmm", "đcm", "dcm",
+    "fuck", "fucking", "shit", "bitch", "asshole",
+]
+_banned_pattern = re.compile(
+    r"(?<!\w)(?:" + "|".join(re.escape(w) for w in sorted(BANNED_WORDS, key=len, reverse=True)) + r")(?!\w)"
+)
+
+
+class ModerationUnavailable(Exception):
+    pass
+
+
+def _fold(content):
+    # Chữ thường, gộp khoảng trắng nhưng GIỮ dấu: "đồ ngủ" và "đồ ngu" là 2 nội dung khác nhau
+    text = unicodedata.normalize("NFC", content or "").casefold()
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def has_banned_words(content):
+    return _banned_pattern.search(_fold(content)) is not None
+
+
+def ask_moderation_model(content):
+    """Hỏi model xem nội dung có phù hợp không. Trả về True/False, lỗi mạng/model -> ModerationUnavailable."""
+    prompt = f"""
+    Hãy kiểm tra nội dung sau đây có chứa từ ngữ tục tĩu, lăng mạ, xúc phạm, quấy rối, phân biệt đối xử hoặc ngôn ngữ không phù hợp không.
+
+    Trả lời chỉ bằng "YES" nếu nội dung phù hợp, "NO" nếu không phù hợp.
+
+    Nội dung: "{content}"
+    """
+
+    try:
+        headers = {"Content-Type": "application/json"}
+        body = {
+            "contents": [
+                {
+                    "parts": [{"text": prompt}]
+                }
+            ]
+        }
+
+        res = requests.post(MODERATION_ENDPOINT, headers=headers, json=body, timeout=MODERATION_TIMEOUT)
+        res.raise_for_status()
+        data = res.json()
+        text = (
+            data.get("candidates", [{}])[0]
+            .get("content", {})
+            .get("parts", [{}])[0]
+            .get("text", "")
+        ).strip().upper()
+    except Exception as e:
+        raise ModerationUnavailable(str(e))
+
+    if text not in ["YES", "NO"]:
+        raise ModerationUnavailable(f"Câu trả lời không hợp lệ: {text!r}")
+    return text == "YES"
+
+
+class VerdictCache:
+    """
+    Cache kết quả duyệt theo hash nội dung (bỏ khác biệt hoa thường / khoảng trắng, giữ dấu):
+    LRU trong bộ nhớ, phía sau là bảng moderation_verdicts dùng chung giữa các worker.
+    Nội dung lặp lại không phải gọi model nữa.
+    """
+
+    def __init__(self, maxsize=VERDICT_CACHE_SIZE):
+        self._memory = TTLCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self.db_hits = 0
+        self.stores = 0
+
+    @staticmethod
+    def content_hash(content):
+        return hashlib.sha256(_fold(content).encode("utf-8")).hexdigest()
+
+    def lookup(self, content):
+        """Trả về True/False nếu đã có kết quả, None nếu chưa."""
+        key = self.content_hash(content)
+        verdict = self._memory.get(key)
+        if verdict is not None:
+            return verdict
+
+        row = db.session.query(ModerationVerdict.clean).filter_by(content_hash=key).first()
+        if row is None:
+            return None
+        with self._lock:
+            self.db_hits += 1
+        self._memory.set(key, row[0])
+        return row[0]
+
+    def store(self, content, clean):
+        key = self.content_hash(content)
+        self._memory.set(key, clean)
+        stmt = mysql_insert(ModerationVerdict).values(content_hash=key, clean=clean)
+        db.session.execute(stmt.on_duplicate_key_update(clean=stmt.inserted.clean))
+        with self._lock:
+            self.stores += 1
+
+    def stats(self):
+        memory = self._memory.stats()
+        lookups = memory["hits"] + memory["misses"]
+        hits = memory["hits"] + self.db_hits
+        return {
+            "memory_size": memory["size"],
+            "memory_hits": memory["hits"],
+            "db_hits": self.db_hits,
+            "misses": lookups - hits,
+            "stores": self.stores,
+            "hit_rate": hits / lookups if lookups else 0,
+        }
+
+
+verdict_cache = VerdictCache()
+
+
+def set_comment_status(comment, status):
+    """
+    Đổi trạng thái duyệt và cập nhật tổng hợp đánh giá tương ứng (không commit).
+    UPDATE có điều kiện theo trạng thái cũ nên 2 worker duyệt trùng 1 bình luận chỉ 1 bên được tính.
+    """
+    old_status = comment.status
+    if old_status == status:
+        return False
+    updated = Comment.query.filter_by(id=comment.id, status=old_status).update({Comment.status: status})
+    if not updated:
+        return False
+    if old_status == CommentStatus.APPROVED:
+        update_rating_summary(comment.product_id, comment.rating, sign=-1)
+    elif status == CommentStatus.APPROVED:
+        update_rating_summary(comment.product_id, comment.rating, sign=1)
+    return True
+
+
+class ModerationQueue:
+    """
+    Hàng đợi duyệt bình luận chạy nền: bình luận được lưu ở trạng thái PENDING,
+    worker gọi model rồi chuyển sang APPROVED / REJECTED, lỗi thì thử lại có giãn cách.
+    """
+
+    def __init__(self, workers=MODERATION_WORKERS, max_retries=MODERATION_MAX_RETRIES,
+                 retry_delay=MODERATION_RETRY_DELAY, sweep_interval=MODERATION_SWEEP_INTERVAL):
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.sweep_interval = sweep_interval
+        self.app = None
+        self._queue = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        # Bình luận đang nằm trong hàng đợi / đang duyệt / chờ thử lại, để lần quét không đưa vào trùng
+        self._inflight = set()
+        self._sweep_connection = None
+        self.enabled = MODERATION_BACKGROUND
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get("MODERATION_BACKGROUND", MODERATION_BACKGROUND)
+        # Lệnh `flask ...` chạy trong click context -> không bật worker nền cho process CLI
+        if self.enabled and click.get_current_context(silent=True) is None:
+            self._start()
+
+    def submit(self, comment_id):
+        if not self.enabled:
+            return
+        # Vd chạy bằng `flask run`: worker được bật ở request đầu tiên gửi bình luận
+        self._start()
+        with self._lock:
+            if comment_id in self._inflight:
+                return
+            self._inflight.add(comment_id)
+        self._queue.put((comment_id, 0))
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._run, name=f"moderation-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+            # Bình luận còn PENDING (server restart, hết lượt thử lại...) được đưa lại vào hàng đợi định kỳ
+            t = threading.Thread(target=self._sweep_loop, name="moderation-sweep", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def pending_ids(self, min_age=0):
+        with self.app.app_context():
+            try:
+                query = db.session.query(Comment.id).filter(Comment.status == CommentStatus.PENDING)
+                if min_age > 0:
+                    query = query.filter(Comment.created_at <= datetime.now() - timedelta(seconds=min_age))
+                return [cid for (cid,) in query.all()]
+            finally:
+                db.session.remove()
+
+    def _owns_sweep(self):
+        """Giữ khóa quét trên 1 kết nối riêng; process chết thì kết nối đóng, process khác nhận khóa."""
+        try:
+            with self.app.app_context():
+                if self._sweep_connection is None:
+                    self._sweep_connection = db.engine.connect()
+                owned = self._sweep_connection.execute(
+                    text("SELECT IF(IS_USED_LOCK(:name) = CONNECTION_ID(), 1, GET_LOCK(:name, 0))"),
+                    {"name": SWEEP_LOCK_NAME},
+                ).scalar()
+                self._sweep_connection.commit()
+                return owned == 1
+        except Exception as e:
+            print("Moderation sweep lock error:", e)
+            if self._sweep_connection is not None:
+                self._sweep_connection.close()
+                self._sweep_connection = None
+            return False
+
+    def requeue_pending(self):
+        try:
+            ids = self.pending_ids(MODERATION_SWEEP_MIN_AGE)
+        except Exception as e:
+            print("Moderation sweep error:", e)
+            return 0
+        for comment_id in ids:
+            self.submit(comment_id)
+        return len(ids)
+
+    def _sweep_loop(self):
+        while True:
+            if self._owns_sweep():
+                self.requeue_pending()
+            if self.sweep_interval <= 0:
+                return
+            time.sleep(self.sweep_interval)
+
+    def _run(self):
+        while True:
+            comment_id, attempt = self._queue.get()
+            done = True
+            try:
+                self._moderate(comment_id)
+            except ModerationUnavailable as e:
+                if attempt < self.max_retries:
+                    delay = self.retry_delay * (2 ** attempt)
+                    print(f"Moderation comment {comment_id} lỗi ({e}), thử lại sau {delay}s")
+                    timer = threading.Timer(delay, self._queue.put, args=((comment_id, attempt + 1),))
+                    timer.daemon = True
+                    timer.start()
+                    done = False
+                else:
+                    # Hết lượt thử: giữ PENDING, lần quét sau sẽ thử lại (hoặc nhân viên duyệt tay)
+                    print(f"Moderation comment {comment_id} thất bại sau {attempt + 1} lần: {e}")
+            except Exception as e:
+                print("Moderation worker error:", e)
+            finally:
+                if done:
+                    with self._lock:
+                        self._inflight.discard(comment_id)
+                self._queue.task_done()
+
+    def _moderate(self, comment_id):
+        with self.app.app_context():
+            try:
+                comment = Comment.query.get(comment_id)
+                if not comment or comment.status != CommentStatus.PENDING:
+                    return
+                content = comment.content
+
+                clean = verdict_cache.lookup(content)
+                if clean is None:
+                    # Đóng transaction trước khi gọi model để không giữ kết nối DB trong lúc chờ
+                    db.session.rollback()
+                    clean = ask_moderation_model(content)
+                    verdict_cache.store(content, clean)
+                    comment = Comment.query.get(comment_id)
+                    if not comment or comment.status != CommentStatus.PENDING:
+                        db.session.commit()
+                        return
+
+                set_comment_status(comment, CommentStatus.APPROVED if clean else CommentStatus.REJECTED)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            finally:
+                db.session.remove()
+
+    def moderate_pending(self, min_age=0):
+        """Duyệt ngay (đồng bộ) các bình luận còn PENDING, dùng cho cron. Trả về (đã duyệt, lỗi)."""
+        done, failed = 0, 0
+        for comment_id in self.pending_ids(min_age):
+            try:
+                self._moderate(comment_id)
+                done += 1
+            except Exception as e:
+                print(f"Moderation comment {comment_id} lỗi: {e}")
+                failed += 1
+        return done, failed
+
+    def qsize(self):
+        return self._queue.qsize()
+
+
+moderation_queue = ModerationQueue()
@@ -0,0 +1,174 @@
+import hmac
+import math
+import os
+import threading
+import time
+from collections import deque
+
+OTP_STORE = os.getenv("OTP_STORE", "memory")  # "memory" hoặc "redis"
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+OTP_TTL = int(os.getenv("OTP_TTL", 300))
+OTP_MAX_ATTEMPTS = int(os.getenv("OTP_MAX_ATTEMPTS", 5))
+# Giới hạn gửi theo số điện thoại: cách nhau tối thiểu OTP_RESEND_INTERVAL giây
+# và không quá OTP_MAX_SENDS lần trong OTP_SEND_WINDOW giây
+OTP_RESEND_INTERVAL = int(os.getenv("OTP_RESEND_INTERVAL", 60))
+OTP_MAX_SENDS = int(os.getenv("OTP_MAX_SENDS", 5))
+OTP_SEND_WINDOW = int(os.getenv("OTP_SEND_WINDOW", 3600))
+
+
+class TimerWheel:
+    """
+    Bánh xe thời gian để dọn key hết hạn: mỗi ô ứng với 1 tick, key được đặt vào ô của
+    thời điểm hết hạn. Mỗi lần quay chỉ duyệt các ô đã qua nên chi phí không phụ thuộc số key.
+    """
+
+    def __init__(self, slots=4096, tick=1.0):
+        self.slots = [set() for _ in range(slots)]
+        self.tick = tick
+        self.current = int(time.monotonic() / tick)
+
+    def schedule(self, key, expires_at):
+        tick = max(int(math.ceil(expires_at / self.tick)), self.current + 1)
+        self.slots[tick % len(self.slots)].add(key)
+
+    def advance(self, now):
+        """Trả về các key nằm trong những ô vừa quay qua (phía gọi tự kiểm tra hạn thật)."""
+        target = int(now / self.tick)
+        if target <= self.current:
+            return []
+        steps = min(target - self.current, len(self.slots))
+        due = []
+        for i in range(1, steps + 1):
+            slot = self.slots[(self.current + i) % len(self.slots)]
+            due.extend(slot)
+            slot.clear()
+        self.current = target
+        return due
+
+
+class MemoryOTPStore:
+    """OTP lưu trong bộ nhớ process (chỉ dùng khi chạy 1 process, nhiều process thì dùng redis)."""
+
+    def __init__(self):
+        self._codes = {}  # phone -> [code, expires_at, attempts]
+        self._sends = {}  # phone -> deque thời điểm gửi
+        self._wheel = TimerWheel()
+        self._lock = threading.Lock()
+
+    def _purge(self, now):
+        for kind, phone in self._wheel.advance(now):
+            if kind == "code":
+                entry = self._codes.get(phone)
+                if entry and entry[1] <= now:
+                    del self._codes[phone]
+                elif entry:
+                    self._wheel.schedule((kind, phone), entry[1])
+            else:
+                sends = self._sends.get(phone)
+                if sends and sends[-1] + OTP_SEND_WINDOW <= now:
+                    del self._sends[phone]
+                elif sends:
+                    self._wheel.schedule((kind, phone), sends[-1] + OTP_SEND_WINDOW)
+
+    def allow_send(self, phone):
+        """Ghi nhận 1 lần gửi nếu còn trong hạn mức. Trả về (được phép, số giây phải chờ)."""
+        now = time.monotonic()
+        with self._lock:
+            self._purge(now)
+            sends = self._sends.setdefault(phone, deque())
+            while sends and sends[0] <= now - OTP_SEND_WINDOW:
+                sends.popleft()
+            if sends and now - sends[-1] < OTP_RESEND_INTERVAL:
+                return False, math.ceil(OTP_RESEND_INTERVAL - (now - sends[-1]))
+            if len(sends) >= OTP_MAX_SENDS:
+                return False, math.ceil(sends[0] + OTP_SEND_WINDOW - now)
+            sends.append(now)
+            self._wheel.schedule(("sends", phone), now + OTP_SEND_WINDOW)
+            return True, 0
+
+    def save(self, phone, code, ttl=OTP_TTL):
+        now = time.monotonic()
+        with self._lock:
+            self._purge(now)
+            self._codes[phone] = [code, now + ttl, 0]
+            self._wheel.schedule(("code", phone), now + ttl)
+
+    def verify(self, phone, code, consume=False):
+        now = time.monotonic()
+        with self._lock:
+            self._purge(now)
+            entry = self._codes.get(phone)
+            if not entry or entry[1] <= now:
+                return False
+            if not hmac.compare_digest(entry[0], str(code)):
+                entry[2] += 1
+                if entry[2] >= OTP_MAX_ATTEMPTS:
+                    # Sai quá số lần cho phép -> hủy mã, phải yêu cầu mã mới
+                    del self._codes[phone]
+                return False
+            if consume:
+                del self._codes[phone]
+            return True
+
+    def discard(self, phone):
+        with self._lock:
+            self._codes.pop(phone, None)
+
+
+class RedisOTPStore:
+    """OTP lưu trên redis, dùng chung giữa các worker; hết hạn do redis tự xử lý."""
+
+    def __init__(self, url=REDIS_URL):
+        import redis  # chỉ cần khi OTP_STORE=redis
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+
+    def allow_send(self, phone):
+        key = f"otp:sends:{phone}"
+        now = time.time()
+        pipe = self._redis.pipeline()
+        pipe.zremrangebyscore(key, 0, now - OTP_SEND_WINDOW)
+        pipe.zrange(key, 0, -1, withscores=True)
+        _, sends = pipe.execute()
+        if sends and now - sends[-1][1] < OTP_RESEND_INTERVAL:
+            return False, math.ceil(OTP_RESEND_INTERVAL - (now - sends[-1][1]))
+        if len(sends) >= OTP_MAX_SENDS:
+            return False, math.ceil(sends[0][1] + OTP_SEND_WINDOW - now)
+        pipe = self._redis.pipeline()
+        pipe.zadd(key, {str(now): now})
+        pipe.expire(key, OTP_SEND_WINDOW)
+        pipe.execute()
+        return True, 0
+
+    def save(self, phone, code, ttl=OTP_TTL):
+        key = f"otp:code:{phone}"
+        pipe = self._redis.pipeline()
+        pipe.delete(key)
+        pipe.hset(key, mapping={"code": code, "attempts": 0})
+        pipe.expire(key, ttl)
+        pipe.execute()
+
+    def verify(self, phone, code, consume=False):
+        key = f"otp:code:{phone}"
+        stored = self._redis.hget(key, "code")
+        if stored is None:
+            return False
+        if not hmac.compare_digest(stored, str(code)):
+            if self._redis.hincrby(key, "attempts", 1) >= OTP_MAX_ATTEMPTS:
+                self._redis.delete(key)
+            return False
+        if consume:
+            # Chỉ 1 request xóa được key -> mã dùng 1 lần kể cả khi gửi song song
+            return self._redis.delete(key) == 1
+        return True
+
+    def discard(self, phone):
+        self._redis.delete(f"otp:code:{phone}")
+
+
+def create_otp_store():
+    if OTP_STORE == "redis":
+        return RedisOTPStore()
+    return MemoryOTPStore()
+
+
+otp_store = create_otp_store()
@@ -0,0 +1,133 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Thông số băm lấy theo chuẩn của werkzeug, vd "scrypt:32768:8:1" hoặc "pbkdf2:sha256:600000"
+PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt")
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", min(4, os.cpu_count() or 1)))
+# Số yêu cầu băm tối đa được chờ cùng lúc (kể cả đang chạy), vượt quá thì từ chối ngay
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", 64))
+PASSWORD_HASH_TIMEOUT = float(os.getenv("PASSWORD_HASH_TIMEOUT", 10))
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    """
+    Băm / kiểm tra mật khẩu trên một pool luồng riêng có giới hạn, để một đợt đăng nhập dồn dập
+    không chiếm hết CPU của worker. scrypt/pbkdf2 của hashlib nhả GIL nên chạy song song được.
+    """
+
+    def __init__(self, method=PASSWORD_HASH_METHOD, workers=PASSWORD_HASH_WORKERS,
+                 max_pending=PASSWORD_HASH_MAX_PENDING, timeout=PASSWORD_HASH_TIMEOUT):
+        self.method = method
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._import_slots = threading.BoundedSemaphore(workers)
+        self.max_pending_seen = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.wait_seconds = 0.0
+        self.run_seconds = 0.0
+        # Tiền tố thông số đầy đủ của cấu hình hiện tại, vd "scrypt" -> "scrypt:32768:8:1"
+        self.method_prefix = generate_password_hash("", method=method).split("$", 1)[0]
+
+    def _run(self, fn, args, queued_at):
+        started = time.monotonic()
+        try:
+            return fn(*args)
+        finally:
+            finished = time.monotonic()
+            with self._lock:
+                self.wait_seconds += started - queued_at
+                self.run_seconds += finished - started
+
+    def _submit(self, fn, *args):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise PasswordHasherBusy("Hệ thống đang bận, vui lòng thử lại sau")
+            self._pending += 1
+            self.max_pending_seen = max(self.max_pending_seen, self._pending)
+        future = self._executor.submit(self._run, fn, args, time.monotonic())
+        future.add_done_callback(self._done)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # Chưa tới lượt thì bỏ khỏi hàng đợi; đang chạy dở thì để chạy xong, _done tự trừ _pending
+            future.cancel()
+            with self._lock:
+                self.rejected += 1
+            raise PasswordHasherBusy("Hệ thống đang bận, vui lòng thử lại sau")
+
+    def _done(self, future):
+        with self._lock:
+            self._pending -= 1
+            if not future.cancelled():
+                self.completed += 1
+
+    def _done_import(self, future):
+        self._done(future)
+        self._import_slots.release()
+
+    def hash(self, password):
+        return self._submit(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._submit(check_password_hash, password_hash, password)
+
+    def hash_many(self, passwords):
+        """
+        Băm cả lô cho import. Mỗi lúc lô chỉ có tối đa `workers` việc trong pool (tính vào _pending),
+        nên yêu cầu đăng nhập chen vào chỉ phải chờ vài việc chứ không chờ hết lô.
+        """
+        futures = []
+        for password in passwords:
+            self._import_slots.acquire()
+            with self._lock:
+                self._pending += 1
+                self.max_pending_seen = max(self.max_pending_seen, self._pending)
+            future = self._executor.submit(self._run, generate_password_hash, (password, self.method), time.monotonic())
+            future.add_done_callback(self._done_import)
+            futures.append(future)
+        return [future.result() for future in futures]
+
+    def needs_rehash(self, password_hash):
+        return password_hash.split("$", 1)[0] != self.method_prefix
+
+    def rehash_if_needed(self, password_hash, password):
+        """Trả về hash mới nếu hash đang lưu dùng cấu hình cũ (gọi sau khi mật khẩu đã đúng), không thì None."""
+        if not self.needs_rehash(password_hash):
+            return None
+        new_hash = self.hash(password)
+        with self._lock:
+            self.rehashed += 1
+        return new_hash
+
+    def stats(self):
+        with self._lock:
+            return {
+                "method": self.method_prefix,
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "pending": self._pending,
+                "max_pending_seen": self.max_pending_seen,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "rehashed": self.rehashed,
+                "avg_wait_ms": self.wait_seconds / self.completed * 1000 if self.completed else 0,
+                "avg_run_ms": self.run_seconds / self.completed * 1000 if self.completed else 0,
+            }
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,61 @@
+from sqlalchemy import func, literal, select
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+
+from . import db
+from .models import Order, OrderItem, PurchaseIndex
+
+
+def buyer_key(user_id=None, phone=None):
+    if user_id:
+        return f"user:{user_id}"
+    if phone:
+        return f"phone:{phone}"
+    return None
+
+
+def record_purchases(order, product_ids):
+    """Ghi nhận người đặt đơn đã mua các sản phẩm (gọi trước khi commit đơn hàng)."""
+    buyer = buyer_key(order.user_id, order.guest_phone)
+    if not buyer or not product_ids:
+        return
+    stmt = mysql_insert(PurchaseIndex).prefix_with("IGNORE").values([
+        {"buyer": buyer, "product_id": product_id} for product_id in set(product_ids)
+    ])
+    db.session.execute(stmt)
+
+
+def has_purchased(buyer, product_id):
+    return db.session.query(
+        PurchaseIndex.query.filter_by(buyer=buyer, product_id=product_id).exists()
+    ).scalar()
+
+
+def purchased_product_ids(buyer, product_ids):
+    if not buyer or not product_ids:
+        return set()
+    rows = db.session.query(PurchaseIndex.product_id).filter(
+        PurchaseIndex.buyer == buyer,
+        PurchaseIndex.product_id.in_(product_ids)
+    ).all()
+    return {product_id for (product_id,) in rows}
+
+
+def rebuild_purchase_index():
+    """Dựng lại bảng purchase_index từ toàn bộ đơn hàng."""
+    PurchaseIndex.query.delete()
+    sources = [
+        (func.concat(literal("user:"), Order.user_id), Order.user_id.isnot(None)),
+        (func.concat(literal("phone:"), Order.guest_phone), Order.user_id.is_(None) & Order.guest_phone.isnot(None)),
+    ]
+    for buyer, condition in sources:
+        source = (
+            select(buyer, OrderItem.product_id)
+            .join(OrderItem, OrderItem.order_id == Order.id)
+            .where(condition)
+            .distinct()
+        )
+        db.session.execute(
+            mysql_insert(PurchaseIndex).prefix_with("IGNORE").from_select(["buyer", "product_id"], source)
+        )
+    db.session.commit()
+    return PurchaseIndex.query.count()
@@ -0,0 +1,192 @@
+import math
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from functools import wraps
+
+from flask import jsonify, request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+
+from .cache import TTLCache
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") != "0"
+RATE_LIMIT_STORE = os.getenv("RATE_LIMIT_STORE", "memory")  # "memory" hoặc "redis"
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", 100000))
+
+
+class MemoryRateLimitBackend:
+    """Trạng thái giới hạn giữ trong bộ nhớ process, số key bị chặn trên bằng LRU."""
+
+    def __init__(self, max_keys=RATE_LIMIT_MAX_KEYS):
+        self._state = TTLCache(maxsize=max_keys)
+        self._lock = threading.Lock()
+
+    def token_bucket(self, key, capacity, rate, now):
+        with self._lock:
+            tokens, updated_at = self._state.get(key) or (capacity, now)
+            tokens = min(capacity, tokens + (now - updated_at) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                allowed, retry_after = True, 0
+            else:
+                allowed, retry_after = False, (1 - tokens) / rate
+            # Đầy lại hoàn toàn sau capacity / rate giây -> không cần giữ lâu hơn
+            self._state.set(key, (tokens, now), ttl=capacity / rate)
+            return allowed, retry_after, int(tokens)
+
+    def sliding_window(self, key, limit, period, now):
+        with self._lock:
+            hits = self._state.get(key)
+            if hits is None:
+                hits = deque()
+            while hits and hits[0] <= now - period:
+                hits.popleft()
+            if len(hits) < limit:
+                hits.append(now)
+                self._state.set(key, hits, ttl=period)
+                return True, 0, limit - len(hits)
+            self._state.set(key, hits, ttl=period)
+            return False, hits[0] + period - now, 0
+
+
+_TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + (now - ts) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate))
+return {allowed, tostring(retry_after), math.floor(tokens)}
+"""
+
+_SLIDING_WINDOW_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local period = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], 0, now - period)
+local count = redis.call('ZCARD', KEYS[1])
+if count < limit then
+    redis.call('ZADD', KEYS[1], now, ARGV[4])
+    redis.call('EXPIRE', KEYS[1], math.ceil(period))
+    return {1, '0', limit - count - 1}
+end
+local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+return {0, tostring(tonumber(oldest[2]) + period - now), 0}
+"""
+
+
+class RedisRateLimitBackend:
+    """Trạng thái giới hạn trên redis, dùng chung giữa các worker; mỗi lần kiểm tra là 1 script nguyên tử."""
+
+    def __init__(self, url=REDIS_URL):
+        import redis  # chỉ cần khi RATE_LIMIT_STORE=redis
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+        self._token_bucket = self._redis.register_script(_TOKEN_BUCKET_SCRIPT)
+        self._sliding_window = self._redis.register_script(_SLIDING_WINDOW_SCRIPT)
+
+    def token_bucket(self, key, capacity, rate, now):
+        allowed, retry_after, remaining = self._token_bucket(keys=[f"rl:{key}"], args=[capacity, rate, now])
+        return bool(allowed), float(retry_after), int(remaining)
+
+    def sliding_window(self, key, limit, period, now):
+        allowed, retry_after, remaining = self._sliding_window(
+            keys=[f"rl:{key}"], args=[limit, period, now, uuid.uuid4().hex]
+        )
+        return bool(allowed), float(retry_after), int(remaining)
+
+
+def create_backend():
+    if RATE_LIMIT_STORE == "redis":
+        return RedisRateLimitBackend()
+    return MemoryRateLimitBackend()
+
+
+backend = create_backend()
+
+
+def _client_ip():
+    return request.remote_addr or "unknown"
+
+
+def _user_key():
+    # Khách chưa đăng nhập (hoặc token lỗi) thì tính theo IP
+    try:
+        verify_jwt_in_request(optional=True)
+        identity = get_jwt_identity()
+    except Exception:
+        identity = None
+    return f"user:{identity}" if identity else f"ip:{_client_ip()}"
+
+
+def _phone_key():
+    data = request.get_json(silent=True) or {}
+    phone = data.get("phone") if isinstance(data, dict) else None
+    return f"phone:{phone}" if phone else f"ip:{_client_ip()}"
+
+
+KEY_FUNCS = {
+    "ip": lambda: f"ip:{_client_ip()}",
+    "user": _user_key,
+    "phone": _phone_key,
+}
+
+
+def _parse_override(name, limit, period):
+    # Cho phép chỉnh từng route bằng biến môi trường, vd RATE_LIMIT_LOGIN="10/60"
+    value = os.getenv(f"RATE_LIMIT_{name.upper().replace('-', '_')}")
+    if not value:
+        return limit, period
+    count, _, seconds = value.partition("/")
+    return int(count), float(seconds or period)
+
+
+def rate_limit(name, limit, period, key="ip", algorithm="sliding_window"):
+    """
+    Giới hạn số request của 1 route: tối đa `limit` request trong `period` giây cho mỗi key
+    (ip / user / phone). token_bucket cho phép dồn tối đa `limit` request rồi hồi dần đều,
+    sliding_window đếm chính xác số request trong cửa sổ trượt. Vượt quá -> 429 kèm Retry-After.
+    """
+    limit, period = _parse_override(name, limit, period)
+    key_func = KEY_FUNCS[key]
+
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not RATE_LIMIT_ENABLED:
+                return fn(*args, **kwargs)
+            bucket_key = f"{name}:{key_func()}"
+            now = time.time()
+            try:
+                if algorithm == "token_bucket":
+                    allowed, retry_after, remaining = backend.token_bucket(bucket_key, limit, limit / period, now)
+                else:
+                    allowed, retry_after, remaining = backend.sliding_window(bucket_key, limit, period, now)
+            except Exception as e:
+                # Kho dùng chung gặp sự cố thì cho qua, không chặn toàn bộ cửa hàng
+                print("Rate limit error:", e)
+                return fn(*args, **kwargs)
+
+            if not allowed:
+                retry_after = max(1, math.ceil(retry_after))
+                response = jsonify({"error": f"Bạn thao tác quá nhanh, vui lòng thử lại sau {retry_after} giây"})
+                response.headers["Retry-After"] = str(retry_after)
+                response.headers["X-RateLimit-Limit"] = str(limit)
+                response.headers["X-RateLimit-Remaining"] = "0"
+                return response, 429
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorator
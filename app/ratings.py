@@ -0,0 +1,86 @@
+from sqlalchemy import func, literal
+
+from . import db
+from .cache import TTLCache
+from .models import Comment, CommentStatus, Product, PurchaseIndex
+
+# Tổng hợp đánh giá của góc nhìn khách vãng lai (chỉ tính comment của SĐT đã mua), theo product_id
+guest_rating_cache = TTLCache(maxsize=2048, ttl=300)
+
+
+def update_rating_summary(product_id, rating, sign=1):
+    """Cộng / trừ 1 lượt đánh giá vào tổng hợp của sản phẩm bằng UPDATE nguyên tử (không commit)."""
+    if not rating or not 1 <= rating <= 5:
+        return
+    guest_rating_cache.pop(product_id)
+    star = getattr(Product, f"rating_{rating}")
+    Product.query.filter_by(id=product_id).update({
+        Product.rating_count: Product.rating_count + sign,
+        Product.rating_sum: Product.rating_sum + sign * rating,
+        star: star + sign,
+    }, synchronize_session=False)
+
+
+def guest_purchase_filter(product_id):
+    """EXISTS: SĐT của comment đã từng đặt mua sản phẩm (semi-join trên unique index của purchase_index)."""
+    return (
+        db.session.query(PurchaseIndex.id)
+        .filter(
+            PurchaseIndex.buyer == literal("phone:") + Comment.guest_phone,
+            PurchaseIndex.product_id == product_id
+        )
+        .exists()
+    )
+
+
+def guest_rating_summary(product_id, comments):
+    cached = guest_rating_cache.get(product_id)
+    if cached is not None:
+        return cached
+
+    histogram = {str(star): 0 for star in range(1, 6)}
+    for rating, count in comments.with_entities(Comment.rating, func.count(Comment.id)) \
+            .group_by(Comment.rating).all():
+        if rating and 1 <= rating <= 5:
+            histogram[str(rating)] = count
+    count_rating = sum(histogram.values())
+    total_rating = sum(int(star) * count for star, count in histogram.items())
+    summary = {
+        "average_rating": total_rating / count_rating if count_rating else 0,
+        "rating_count": count_rating,
+        "rating_histogram": histogram
+    }
+    guest_rating_cache.set(product_id, summary)
+    return summary
+
+
+def rebuild_rating_summaries():
+    """Tính lại tổng hợp đánh giá của toàn bộ sản phẩm từ bảng comments."""
+    Product.query.update({
+        Product.rating_count: 0,
+        Product.rating_sum: 0,
+        Product.rating_1: 0,
+        Product.rating_2: 0,
+        Product.rating_3: 0,
+        Product.rating_4: 0,
+        Product.rating_5: 0,
+    }, synchronize_session=False)
+
+    rows = (
+        db.session.query(Comment.product_id, Comment.rating, func.count(Comment.id))
+        .filter(Comment.rating.between(1, 5), Comment.status == CommentStatus.APPROVED)
+        .group_by(Comment.product_id, Comment.rating)
+        .all()
+    )
+    summaries = {}
+    for product_id, rating, count in rows:
+        summary = summaries.setdefault(product_id, {"id": product_id, "rating_count": 0, "rating_sum": 0})
+        summary["rating_count"] += count
+        summary["rating_sum"] += rating * count
+        summary[f"rating_{rating}"] = count
+
+    if summaries:
+        db.session.bulk_update_mappings(Product, list(summaries.values()))
+    db.session.commit()
+    guest_rating_cache.clear()
+    return len(summaries)
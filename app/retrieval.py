@@ -0,0 +1,82 @@
+import os
+import zlib
+
+import numpy as np
+
+from .utils import normalize_text
+
+# Số chiều không gian đặc trưng sau khi băm n-gram
+INDEX_FEATURES = int(os.getenv("CHATBOT_INDEX_FEATURES", 1 << 18))
+NGRAM_SIZES = (2, 3, 4)
+
+
+def text_features(text, n_features=INDEX_FEATURES):
+    """N-gram ký tự (có đệm khoảng trắng đầu/cuối từ) + nguyên từ, băm về [0, n_features)."""
+    text = normalize_text(text)
+    grams = []
+    for word in text.split():
+        grams.append("w:" + word)
+        padded = f" {word} "
+        for n in NGRAM_SIZES:
+            grams.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+    if not grams:
+        return np.zeros(0, dtype=np.int64)
+    return np.array([zlib.crc32(g.encode("utf-8")) % n_features for g in grams], dtype=np.int64)
+
+
+class ProductIndex:
+    """
+    Chỉ mục TF-IDF trên n-gram ký tự của tên + thông số sản phẩm, lưu dạng inverted index
+    (các mảng NumPy sắp theo đặc trưng). Truy vấn chỉ cộng điểm trên posting list của các
+    đặc trưng có trong câu hỏi nên không phụ thuộc tuyến tính vào kích thước catalog.
+    """
+
+    def __init__(self, documents, n_features=INDEX_FEATURES):
+        self.n_features = n_features
+        self.size = len(documents)
+
+        doc_ids, features, counts = [], [], []
+        for doc_id, text in enumerate(documents):
+            unique, count = np.unique(text_features(text, n_features), return_counts=True)
+            doc_ids.append(np.full(len(unique), doc_id, dtype=np.int64))
+            features.append(unique)
+            counts.append(count)
+        doc_ids = np.concatenate(doc_ids) if doc_ids else np.zeros(0, dtype=np.int64)
+        features = np.concatenate(features) if features else np.zeros(0, dtype=np.int64)
+        counts = np.concatenate(counts).astype(np.float64) if counts else np.zeros(0)
+
+        df = np.bincount(features, minlength=n_features)
+        self.idf = np.log((1 + self.size) / (1 + df)) + 1
+        weights = (1 + np.log(counts)) * self.idf[features]
+        norms = np.sqrt(np.bincount(doc_ids, weights=weights ** 2, minlength=self.size))
+        weights /= np.where(norms > 0, norms, 1)[doc_ids]
+
+        order = np.argsort(features, kind="stable")
+        self.features = features[order]
+        self.doc_ids = doc_ids[order]
+        self.weights = weights[order]
+
+    def search(self, query, k=8, min_score=0.05):
+        """Trả về [(vị trí tài liệu, điểm cosine)] của k tài liệu gần nhất."""
+        if not self.size:
+            return []
+        unique, count = np.unique(text_features(query, self.n_features), return_counts=True)
+        if not len(unique):
+            return []
+        query_weights = (1 + np.log(count)) * self.idf[unique]
+        query_weights /= np.linalg.norm(query_weights)
+
+        starts = np.searchsorted(self.features, unique, side="left")
+        ends = np.searchsorted(self.features, unique, side="right")
+        lengths = ends - starts
+        if not lengths.sum():
+            return []
+        # Ghép chỉ số của mọi posting list cần đọc thành 1 mảng rồi cộng điểm 1 lần
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        scores = np.zeros(self.size, dtype=np.float64)
+        np.add.at(scores, self.doc_ids[positions], self.weights[positions] * np.repeat(query_weights, lengths))
+
+        k = min(k, self.size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(i), float(scores[i])) for i in top if scores[i] >= min_score]
@@ -0,0 +1,167 @@
+import hashlib
+import math
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+
+from . import db
+from .models import RevokedToken
+
+# Mỗi worker đọc thêm các dòng thu hồi mới sau mỗi khoảng này (giây)
+REVOCATION_SYNC_INTERVAL = float(os.getenv("REVOCATION_SYNC_INTERVAL", 5))
+# Mỗi lần đồng bộ đọc lại các dòng tạo trong khoảng này trước lần đồng bộ trước (giây), để không bỏ sót
+# dòng có created_at / id nhỏ nhưng transaction commit muộn; nên lớn hơn thời gian transaction + lệch giờ
+REVOCATION_SYNC_OVERLAP = float(os.getenv("REVOCATION_SYNC_OVERLAP", 30))
+# Dựng lại bộ lọc định kỳ để bỏ các key đã hết hạn (Bloom filter không xóa được phần tử)
+REVOCATION_REBUILD_INTERVAL = float(os.getenv("REVOCATION_REBUILD_INTERVAL", 3600))
+REVOCATION_BLOOM_CAPACITY = int(os.getenv("REVOCATION_BLOOM_CAPACITY", 100000))
+REVOCATION_BLOOM_ERROR_RATE = float(os.getenv("REVOCATION_BLOOM_ERROR_RATE", 0.001))
+
+
+class BloomFilter:
+    def __init__(self, capacity=REVOCATION_BLOOM_CAPACITY, error_rate=REVOCATION_BLOOM_ERROR_RATE):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # Double hashing: 2 giá trị 64 bit sinh ra k vị trí
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class TokenRevocation:
+    """
+    Danh sách token bị thu hồi lưu ở bảng revoked_tokens, mỗi worker giữ 1 Bloom filter trong bộ nhớ.
+    Trường hợp phổ biến (token không bị thu hồi) chỉ cần kiểm tra bộ lọc; chỉ khi bộ lọc báo
+    "có thể" mới đọc DB để xác nhận. Bộ lọc đồng bộ tăng dần theo created_at (có khoảng chồng lấn) giữa các worker.
+    """
+
+    def __init__(self):
+        self.app = None
+        self._lock = threading.Lock()
+        self._filter = BloomFilter()
+        self._last_id = 0
+        self._last_sync_at = None  # giờ hệ thống lúc bắt đầu lần đồng bộ trước
+        self._recent_ids = set()  # id các dòng đã đọc còn nằm trong khoảng chồng lấn
+        self._synced_at = 0
+        self._built_at = 0
+        self.checks = 0
+        self.filter_hits = 0
+        self.revoked_hits = 0
+
+    def init_app(self, app, jwt):
+        self.app = app
+        self.access_expires = app.config.get("JWT_ACCESS_TOKEN_EXPIRES") or timedelta(minutes=15)
+        jwt.token_in_blocklist_loader(self.is_revoked)
+
+    def _sync(self):
+        now = time.monotonic()
+        if now - self._synced_at < REVOCATION_SYNC_INTERVAL:
+            return
+        with self._lock:
+            if now - self._synced_at < REVOCATION_SYNC_INTERVAL:
+                return
+            started = datetime.now()
+            overlap = timedelta(seconds=REVOCATION_SYNC_OVERLAP)
+            rebuild = self._last_sync_at is None or now - self._built_at >= REVOCATION_REBUILD_INTERVAL
+            query = db.session.query(RevokedToken.id, RevokedToken.key, RevokedToken.created_at)
+            if rebuild:
+                query = query.filter(RevokedToken.expires_at > started)
+                bloom, seen = BloomFilter(), set()
+            else:
+                query = query.filter(RevokedToken.created_at >= self._last_sync_at - overlap)
+                bloom, seen = self._filter, self._recent_ids
+            last_id = 0 if rebuild else self._last_id
+            recent = set()
+            for row_id, key, created_at in query.all():
+                if row_id not in seen:
+                    bloom.add(key)
+                # Các dòng lần sau còn đọc lại -> nhớ id để không thêm trùng vào bộ lọc
+                if created_at and created_at >= started - overlap:
+                    recent.add(row_id)
+                last_id = max(last_id, row_id)
+            self._filter = bloom
+            self._recent_ids = recent
+            self._last_id = last_id
+            self._last_sync_at = started
+            self._synced_at = now
+            if rebuild:
+                self._built_at = now
+
+    def is_revoked(self, jwt_header, jwt_payload):
+        self.checks += 1
+        self._sync()
+        jti_key = f"jti:{jwt_payload.get('jti')}"
+        user_key = f"user:{jwt_payload.get('sub')}"
+        candidates = [key for key in (jti_key, user_key) if key in self._filter]
+        if not candidates:
+            return False
+
+        self.filter_hits += 1
+        rows = RevokedToken.query.filter(RevokedToken.key.in_(candidates)).all()
+        issued_at = datetime.fromtimestamp(jwt_payload.get("iat", 0))
+        for row in rows:
+            # iat chỉ chính xác tới giây: token cấp trong cùng giây với lúc thu hồi (vd đăng nhập lại ngay
+            # sau khi bị đổi quyền) vẫn hợp lệ
+            if row.key == jti_key or (row.revoked_before and issued_at < row.revoked_before):
+                self.revoked_hits += 1
+                return True
+        return False
+
+    def _store(self, key, expires_at, revoked_before=None):
+        stmt = mysql_insert(RevokedToken).values(
+            key=key, expires_at=expires_at, revoked_before=revoked_before, created_at=datetime.now()
+        )
+        # Ghi đè created_at để worker khác đọc lại dòng ở lần đồng bộ tăng dần kế tiếp
+        db.session.execute(stmt.on_duplicate_key_update(
+            expires_at=stmt.inserted.expires_at,
+            revoked_before=stmt.inserted.revoked_before,
+            created_at=stmt.inserted.created_at,
+        ))
+        # Worker hiện tại thấy ngay, các worker khác thấy ở lần đồng bộ kế tiếp
+        with self._lock:
+            self._filter.add(key)
+
+    def revoke_token(self, jwt_payload):
+        """Thu hồi 1 token (vd khi logout), giữ tới lúc token tự hết hạn. Không commit."""
+        expires_at = datetime.fromtimestamp(jwt_payload["exp"]) if "exp" in jwt_payload \
+            else datetime.now() + self.access_expires
+        self._store(f"jti:{jwt_payload['jti']}", expires_at)
+
+    def revoke_user(self, user_id):
+        """Thu hồi mọi token đã cấp cho user tính tới hiện tại. Không commit."""
+        now = datetime.now().replace(microsecond=0)
+        self._store(f"user:{user_id}", now + self.access_expires, revoked_before=now)
+
+    def purge_expired(self):
+        deleted = RevokedToken.query.filter(RevokedToken.expires_at <= datetime.now()).delete()
+        db.session.commit()
+        return deleted
+
+    def stats(self):
+        return {
+            "filter_inserts": self._filter.count,
+            "filter_bits": self._filter.size,
+            "checks": self.checks,
+            "filter_hits": self.filter_hits,
+            "revoked_hits": self.revoked_hits,
+            "last_synced_id": self._last_id,
+        }
+
+
+token_revocation = TokenRevocation()
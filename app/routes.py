@@ -1,25 +1,42 @@
 from flask import Blueprint, jsonify,make_response,request
 from .models import (Category, Product, User, UserRole, Order, OrderItem, CartItem, Comment, CommentVote,
-                    ProductImage,OrderStatus,Brand,OTP,DeliveryStatus,ExtraCost,StockIn,StockInLog,SearchHistory)
+                    ProductImage,OrderStatus,Brand,DeliveryStatus,ExtraCost,StockIn,StockInLog,SearchHistory,
+                    InventoryForecast,CommentStatus)
 from . import db,mail
-from sqlalchemy.orm import contains_eager
-from sqlalchemy import case,func,or_
-from flask_jwt_extended import jwt_required, get_jwt_identity,create_access_token
+from sqlalchemy.orm import contains_eager,joinedload
+from sqlalchemy import case,func,or_,and_
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.exc import IntegrityError
+from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 import os, requests, random,cloudinary,cloudinary.uploader,hashlib,hmac,uuid,re
-from google.auth.transport import requests as google_requests
-from .utils import time_ago,send_order_success_email,generate_unique_order_code,staff_required,admin_required,send_order_delivered_email
+from .utils import (time_ago,send_order_success_email,generate_unique_order_code,staff_required,admin_required,
+                    send_order_delivered_email,first_image_urls,create_user_token,get_current_user,
+                    invalidate_user_cache)
 from datetime import datetime,timedelta
 from flask_mail import Message
-from google.oauth2 import id_token
-from werkzeug.security import generate_password_hash,check_password_hash
+from .passwords import password_hasher,PasswordHasherBusy
 from dotenv import load_dotenv
 from .socket_events import clients_rooms
+from .moderation import moderation_queue,has_banned_words,set_comment_status,verdict_cache
+from .purchases import buyer_key,has_purchased,purchased_product_ids,record_purchases
+from .google_auth import verify_google_id_token,GoogleCertsUnavailable
+from .revocation import token_revocation
+from .rate_limit import rate_limit
+from .catalog import relevant_product_context
+from .chatbot import chat_response_cache,SHOP_ADDRESS,SHOP_WARRANTY,SHOP_HOTLINE
+from .cart_cache import cart_cache,collapse_cart_operations
+from .otp_store import otp_store,OTP_TTL
+from .user_import import UserImporter,iter_csv_rows,iter_ndjson_rows
+from .ratings import update_rating_summary,guest_purchase_filter,guest_rating_summary
+from .stats import record_order_sales,on_order_status_change,sales_timeseries,top_products,PERIODS
 from math import ceil
 load_dotenv()
 UPLOAD_FOLDER = "static/uploads"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 main = Blueprint("main", __name__)
 
+ROLE_RANK = {UserRole.CUSTOMER: 0, UserRole.STAFF: 1, UserRole.ADMIN: 2}
+
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
 
 API_KEY = os.getenv("GOOGLE_API_KEY")
@@ -41,42 +58,6 @@ ZALO_CREATE_ORDER_URL = os.getenv("ZALO_CREATE_ORDER_URL")
 ZALO_NOTIFY_URL = os.getenv("ZALO_NOTIFY_URL")
 
 
-def is_comment_clean(content):
-    prompt = f"""
-    Hãy kiểm tra nội dung sau đây có chứa từ ngữ tục tĩu, lăng mạ, xúc phạm, quấy rối, phân biệt đối xử hoặc ngôn ngữ không phù hợp không.
-
-    Trả lời chỉ bằng "YES" nếu nội dung phù hợp, "NO" nếu không phù hợp.
-
-    Nội dung: "{content}"
-    """
-
-    try:
-        headers = {"Content-Type": "application/json"}
-        body = {
-            "contents": [
-                {
-                    "parts": [{"text": prompt}]
-                }
-            ]
-        }
-
-        res = requests.post(ENDPOINT, headers=headers, json=body, timeout=20)
-        res.raise_for_status()
-        data = res.json()
-        text = (
-            data.get("candidates", [{}])[0]
-            .get("content", {})
-            .get("parts", [{}])[0]
-            .get("text", "")
-        ).strip().upper()
-
-        return text == "YES"
-    except Exception as e:
-        print("Gemini moderation error:", e)
-        # Nếu không chắc chắn thì chặn để an toàn
-        return False
-
-
 @main.route("/categories", methods=["GET"])
 def get_categories():
     categories = Category.query.all()
@@ -140,6 +121,8 @@ def get_products():
     search = request.args.get("search", "", type=str).strip()
     category = request.args.get("category", "", type=str).strip()
     brand = request.args.get("brand", "", type=str).strip()
+    sort = request.args.get("sort", "", type=str).strip()
+    min_rating = request.args.get("min_rating", type=float)
 
     query = (
         db.session.query(
@@ -171,10 +154,22 @@ def get_products():
     if brand:
         query = query.join(Brand).filter(Brand.name == brand)
 
+    # --- Lọc theo số sao trung bình (dùng cột tổng hợp, không cần join comments) ---
+    if min_rating:
+        query = query.filter(
+            Product.rating_count > 0,
+            Product.rating_sum >= min_rating * Product.rating_count
+        )
+
     total = query.count()
 
+    if sort == "rating":
+        order = [(Product.rating_sum / func.nullif(Product.rating_count, 0)).desc(), Product.rating_count.desc()]
+    else:
+        order = [func.rand()]
+
     products = (
-        query.order_by(func.rand())
+        query.order_by(*order)
         .offset((page - 1) * per_page)
         .limit(per_page)
         .all()
@@ -206,7 +201,8 @@ def get_products():
             "graphics_card": p.graphics_card,
             "ports": p.ports,
             "warranty": p.warranty,
-            "sold": sold
+            "sold": sold,
+            **p.rating_summary()
         })
 
     return jsonify({
@@ -251,6 +247,7 @@ def register():
 
 
 @main.route("/login", methods=["POST"])
+@rate_limit("login", 10, 60, key="ip")
 def login():
     data = request.get_json()
     username = data.get("username")
@@ -260,8 +257,10 @@ def login():
 
     if not user or not user.check_password(password):
         return jsonify({"error": "Đăng nhập thất bại: sai tên tài khoản hoặc mật khẩu"}), 401
+    if user.upgrade_password_hash(password):
+        db.session.commit()
 
-    access_token = create_access_token(identity=str(user.id))
+    access_token = create_user_token(user)
     return jsonify({
         "access_token": access_token,
         "user": user.username,
@@ -269,6 +268,14 @@ def login():
     }), 200
 
 
+@main.route("/logout", methods=["POST"])
+@jwt_required()
+def logout():
+    token_revocation.revoke_token(get_jwt())
+    db.session.commit()
+    return jsonify({"message": "Đăng xuất thành công"}), 200
+
+
 @main.route("/profile", methods=["GET"])
 @jwt_required()
 def profile():
@@ -284,6 +291,7 @@ def profile():
 
 
 @main.route("/products/search", methods=["GET"])
+@rate_limit("search", 30, 10, key="ip", algorithm="token_bucket")
 def search_products():
     keyword = request.args.get("q", "").strip()
     if not keyword:
@@ -338,7 +346,61 @@ def get_product_detail(product_id):
         "release_date": product.release_date.strftime("%d/%m/%Y") if product.release_date else None,
         "graphics_card": product.graphics_card,
         "ports": product.ports,
-        "warranty": product.warranty
+        "warranty": product.warranty,
+        **product.rating_summary()
+    })
+
+
+@main.route("/products/reviewable", methods=["GET"])
+@jwt_required(optional=True)
+def get_reviewable_products():
+    # ids=1,2,3 -> trả về các sản phẩm trong danh sách mà người dùng / SĐT khách (kèm otp) được phép đánh giá
+    try:
+        product_ids = [int(x) for x in request.args.get("ids", "").split(",") if x.strip()]
+    except ValueError:
+        return jsonify({"error": "ids không hợp lệ"}), 400
+    if len(product_ids) > 100:
+        return jsonify({"error": "Tối đa 100 sản phẩm mỗi lần"}), 400
+
+    user_id = get_jwt_identity()
+    if user_id:
+        user = get_current_user()
+        if user and user.role in [UserRole.ADMIN, UserRole.STAFF]:
+            return jsonify({"product_ids": product_ids})
+        buyer = buyer_key(user_id=user_id)
+    else:
+        phone = request.args.get("phone", "").strip()
+        otp = request.args.get("otp", "").strip()
+        if not phone or not otp:
+            return jsonify({"error": "Khách vãng lai phải nhập số điện thoại và mã OTP"}), 400
+        # Chỉ chủ số điện thoại mới xem được lịch sử mua của số đó
+        if not otp_store.verify(phone, otp):
+            return jsonify({"error": "Mã OTP không hợp lệ hoặc đã hết hạn"}), 400
+        buyer = buyer_key(phone=phone)
+
+    reviewable = purchased_product_ids(buyer, product_ids)
+    return jsonify({"product_ids": [pid for pid in product_ids if pid in reviewable]})
+
+
+@main.route("/products/top", methods=["GET"])
+def get_top_products():
+    period = request.args.get("period", "week")
+    category = request.args.get("category", "", type=str).strip() or None
+    n = request.args.get("n", 10, type=int)
+    kind = request.args.get("kind", "best")
+
+    if period not in PERIODS:
+        return jsonify({"error": f"period phải là một trong {PERIODS}"}), 400
+    if kind not in ["best", "slow"]:
+        return jsonify({"error": "kind phải là best hoặc slow"}), 400
+    n = max(1, min(n, 50))
+
+    products = top_products(period, category, n, slow=(kind == "slow"))
+    return jsonify({
+        "period": period,
+        "category": category,
+        "kind": kind,
+        "products": products
     })
 
 
@@ -364,6 +426,7 @@ def update_profile():
             return jsonify({"error": "Số điện thoại đã được sử dụng"}), 400
         user.phone = phone
     db.session.commit()
+    invalidate_user_cache(user.id)
     return jsonify({"message": "Cập nhật thành công"}), 200
 
 
@@ -416,6 +479,8 @@ def buy_now():
 
         db.session.add(order)
         db.session.add(order_item)
+        db.session.flush()
+        record_purchases(order, [product.id])
         db.session.commit()
 
         return jsonify({
@@ -447,21 +512,38 @@ def buy_now():
 @jwt_required()
 def get_cart():
     user_id = get_jwt_identity()
-    cart_items = CartItem.query.filter_by(user_id=user_id).all()
+    return jsonify(serialize_cart(user_id)), 200
 
-    result = [
-        {
-            "id": item.id,
-            "product_id": item.product.id,
-            "name": item.product.name,
-            "images": [img.url for img in item.product.images],
-            "unit_price": item.product.price,
-            "quantity": item.quantity,
-            "total_price": item.quantity * item.product.price
-        }
-        for item in cart_items
-    ]
-    return jsonify(result), 200
+
+def serialize_cart(user_id):
+    # Dòng giỏ hàng lấy từ cache, giá / tồn kho luôn đọc mới từ products (1 truy vấn) + ảnh đầu tiên (1 truy vấn)
+    lines = cart_cache.lines(user_id)
+    if not lines:
+        return []
+    products = {
+        row[0]: row for row in db.session.query(Product.id, Product.name, Product.price, Product.stock)
+        .filter(Product.id.in_(lines.keys())).all()
+    }
+    images = first_image_urls(products.keys())
+
+    result = []
+    for product_id, line in sorted(lines.items(), key=lambda x: x[1]["id"]):
+        if product_id not in products:
+            continue
+        _, name, price, stock = products[product_id]
+        quantity = line["quantity"]
+        result.append({
+            "id": line["id"],
+            "product_id": product_id,
+            "name": name,
+            "images": [images[product_id]] if product_id in images else [],
+            "unit_price": price,
+            "quantity": quantity,
+            "total_price": quantity * price,
+            "stock": stock,
+            "in_stock": stock >= quantity
+        })
+    return result
 
 
 @main.route("/cart/add", methods=["POST"])
@@ -476,20 +558,29 @@ def add_to_cart():
     if not product_id:
         return jsonify({"error": "Thiếu product_id"}), 400
 
-    product = Product.query.get(product_id)
-    if not product:
+    # Upsert 1 câu lệnh; sản phẩm không tồn tại thì khóa ngoại báo lỗi
+    try:
+        cart_cache.add(user_id, int(product_id), quantity)
+    except IntegrityError:
+        db.session.rollback()
         return jsonify({"error": "Sản phẩm không tồn tại"}), 404
+    return jsonify({"message": "Thêm vào giỏ hàng thành công"}), 200
 
-    # Kiểm tra sản phẩm đã tồn tại trong giỏ hàng
-    existing_item = CartItem.query.filter_by(user_id=user_id, product_id=product_id).first()
-    if existing_item:
-        existing_item.quantity += quantity
-    else:
-        new_item = CartItem(user_id=user_id, product_id=product_id, quantity=quantity)
-        db.session.add(new_item)
 
-    db.session.commit()
-    return jsonify({"message": "Thêm vào giỏ hàng thành công"}), 200
+@main.route("/cart/batch", methods=["POST"])
+@jwt_required()
+def batch_cart():
+    # Nhận nhiều thao tác add / set / remove, áp trong 1 transaction và trả về giỏ hàng mới
+    user_id = int(get_jwt_identity())
+    data = request.get_json() or {}
+
+    try:
+        final = collapse_cart_operations(data.get("operations"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    skipped = cart_cache.apply_batch(user_id, final)
+    return jsonify({"cart": serialize_cart(user_id), "skipped_product_ids": skipped}), 200
 
 
 @main.route("/cart/update/<int:product_id>", methods=["PUT"])
@@ -499,12 +590,8 @@ def update_cart_item(product_id):
     data = request.get_json()
     quantity = int(data.get("quantity", 1))
 
-    item = CartItem.query.filter_by(user_id=user_id, product_id=product_id).first()
-    if not item:
+    if not cart_cache.set_quantity(user_id, product_id, quantity):
         return jsonify({"error": "Không tìm thấy mục giỏ hàng"}), 404
-
-    item.quantity = quantity
-    db.session.commit()
     return jsonify({"message": "Cập nhật số lượng thành công"}), 200
 
 
@@ -513,13 +600,9 @@ def update_cart_item(product_id):
 def delete_cart_item(item_id):
     user_id = get_jwt_identity()
 
-    # Lấy bản ghi CartItem theo id (item_id) và kiểm tra user_id
-    item = CartItem.query.filter_by(id=item_id, user_id=user_id).first()
-    if not item:
+    # Xóa theo id kèm điều kiện user_id
+    if not cart_cache.remove_item(user_id, item_id):
         return jsonify({"error": "Không tìm thấy mục giỏ hàng"}), 404
-
-    db.session.delete(item)
-    db.session.commit()
     return jsonify({"message": "Xóa khỏi giỏ hàng thành công"}), 200
 
 @main.route("/orders/guest", methods=["POST"])
@@ -532,9 +615,7 @@ def guest_orders():
     if not phone or not otp:
         return jsonify({"error": "Thiếu số điện thoại hoặc OTP"}), 400
 
-    # Kiểm tra OTP trong DB
-    otp_entry = OTP.query.filter_by(phone=phone).first()
-    if not otp_entry or not otp_entry.is_valid(otp):
+    if not otp_store.verify(phone, otp):
         return jsonify({"error": "OTP không hợp lệ hoặc đã hết hạn"}), 400
 
     # Lấy đơn hàng
@@ -573,26 +654,41 @@ def guest_orders():
 def get_comments(product_id):
     user_id = get_jwt_identity()
     session_id = request.cookies.get("session_id")
+    limit = request.args.get("limit", 10, type=int)
+    limit = max(1, min(limit, 50))
+    cursor = request.args.get("cursor")
 
-    comments = Comment.query.filter_by(product_id=product_id)
+    product = Product.query.get_or_404(product_id)
+    comments = Comment.query.filter_by(product_id=product_id, status=CommentStatus.APPROVED)
+    rating_summary = product.rating_summary()
 
     # Nếu là guest, chỉ trả comment mà guest_phone đã từng mua sản phẩm
     if not user_id and session_id:
-        # Lấy danh sách số điện thoại đã mua sản phẩm này
-        purchased_phones = db.session.query(Order.guest_phone)\
-            .join(OrderItem)\
-            .filter(OrderItem.product_id == product_id)\
-            .distinct().all()
-        purchased_phones = [p[0] for p in purchased_phones]
-
-        comments = comments.filter(Comment.guest_phone.in_(purchased_phones))
-
-    comments = comments.order_by(Comment.created_at.desc()).all()
+        comments = comments.filter(guest_purchase_filter(product_id))
+        # Danh sách đã lọc nên không dùng được tổng hợp có sẵn, tính 1 lần rồi cache theo sản phẩm
+        rating_summary = guest_rating_summary(product_id, comments)
+
+    # Phân trang theo con trỏ (created_at, id), cursor có dạng "<created_at ISO>_<id>"
+    if cursor:
+        try:
+            cursor_time, cursor_id = cursor.rsplit("_", 1)
+            cursor_time = datetime.fromisoformat(cursor_time)
+            cursor_id = int(cursor_id)
+        except ValueError:
+            return jsonify({"error": "cursor không hợp lệ"}), 400
+        comments = comments.filter(or_(
+            Comment.created_at < cursor_time,
+            and_(Comment.created_at == cursor_time, Comment.id < cursor_id)
+        ))
+
+    page = comments.options(joinedload(Comment.user).load_only(User.username))\
+        .order_by(Comment.created_at.desc(), Comment.id.desc())\
+        .limit(limit + 1).all()
+    has_more = len(page) > limit
+    page = page[:limit]
 
     result = []
-    total_rating = 0
-    count_rating = 0
-    for c in comments:
+    for c in page:
         result.append({
             "id": c.id,
             "username": c.user.username if c.user else None,
@@ -604,29 +700,46 @@ def get_comments(product_id):
             "reply_at": time_ago(c.reply_at) if c.reply_at else None,
             "likes": c.likes or 0,
         })
-        if c.rating:
-            total_rating += c.rating
-            count_rating += 1
 
-    average_rating = total_rating / count_rating if count_rating > 0 else 0
+    next_cursor = None
+    if has_more:
+        last = page[-1]
+        next_cursor = f"{last.created_at.isoformat()}_{last.id}"
 
     return jsonify({
         "comments": result,
-        "average_rating": average_rating
+        **rating_summary,
+        "next_cursor": next_cursor
     })
 
 
 @main.route('/products/<int:product_id>/comments', methods=['POST'])
 @jwt_required(optional=True)  # cho phép guest
+@rate_limit("comment", 5, 60, key="user", algorithm="token_bucket")
 def add_comment(product_id):
     try:
         data = request.get_json()
         content = data.get("content")
-        if not is_comment_clean(content):
-            return jsonify({"error": "Nội dung bình luận không phù hợp. Vui lòng điều chỉnh lại."}), 400
-        rating = data.get("rating")
         if not content:
             return jsonify({"error": "Nội dung không được để trống"}), 400
+        # Lọc nhanh từ ngữ tục tĩu rõ ràng tại chỗ, phần còn lại để model duyệt nền
+        if has_banned_words(content):
+            return jsonify({"error": "Nội dung bình luận không phù hợp. Vui lòng điều chỉnh lại."}), 400
+        # Nội dung giống hệt (chỉ khác hoa thường / khoảng trắng) đã được model duyệt thì dùng lại kết quả
+        cached_verdict = verdict_cache.lookup(content)
+        if cached_verdict is False:
+            return jsonify({"error": "Nội dung bình luận không phù hợp. Vui lòng điều chỉnh lại."}), 400
+        # Không chấm sao thì giữ None, bình luận không được tính vào điểm trung bình
+        rating = data.get("rating")
+        if rating not in [None, ""]:
+            try:
+                rating = int(rating)
+            except (TypeError, ValueError):
+                rating = 0
+            if not 1 <= rating <= 5:
+                return jsonify({"error": "Số sao đánh giá phải từ 1 đến 5"}), 400
+        else:
+            rating = None
 
         user_id = get_jwt_identity()
         guest_name = data.get("guest_name")
@@ -637,30 +750,14 @@ def add_comment(product_id):
             if user.role in [UserRole.ADMIN, UserRole.STAFF]:
                 purchased = True
             else:
-                purchased = (
-                    db.session.query(OrderItem)
-                    .join(Order)
-                    .filter(
-                        Order.user_id == user_id,
-                        OrderItem.product_id == product_id,
-                    )
-                    .first()
-                )
+                purchased = has_purchased(buyer_key(user_id=user_id), product_id)
                 if not purchased:
                     return jsonify({"error": "Bạn phải mua sản phẩm này mới được bình luận"}), 403
         else:
             if not guest_name or not guest_phone:
                 return jsonify({"error": "Khách vãng lai phải nhập họ tên và số điện thoại"}), 400
 
-            purchased = (
-                db.session.query(OrderItem)
-                .join(Order)
-                .filter(
-                    Order.guest_phone == guest_phone,
-                    OrderItem.product_id == product_id,
-                )
-                .first()
-            )
+            purchased = has_purchased(buyer_key(phone=guest_phone), product_id)
             if not purchased:
                 return jsonify({"error": "Số điện thoại này chưa mua sản phẩm, không thể bình luận"}), 403
 
@@ -671,14 +768,19 @@ def add_comment(product_id):
             guest_name=guest_name if not user_id else None,
             guest_phone=guest_phone if not user_id else None,
             content=content,
-            rating=rating
+            rating=rating,
+            status=CommentStatus.APPROVED if cached_verdict else CommentStatus.PENDING
         )
 
         db.session.add(comment)
+        if cached_verdict and rating:
+            update_rating_summary(product_id, rating)
         db.session.commit()
+        if not cached_verdict:
+            moderation_queue.submit(comment.id)
 
         return jsonify({
-            "message": "Bình luận thành công",
+            "message": "Bình luận thành công" if cached_verdict else "Bình luận đã được ghi nhận và đang chờ duyệt",
             "comment": {
                 "id": comment.id,
                 "username": comment.user.username if comment.user else None,
@@ -686,7 +788,8 @@ def add_comment(product_id):
                 "content": comment.content,
                 "rating": comment.rating,
                 "created_at": time_ago(comment.created_at),
-                "likes": 0
+                "likes": 0,
+                "status": comment.status.value
             }
         }), 201
 
@@ -712,31 +815,39 @@ def vote_comment(comment_id):
     if not user_id and not session_id:
         session_id = str(uuid.uuid4())
 
-    # Kiểm tra đã vote
-    if user_id:
-        vote = CommentVote.query.filter_by(comment_id=comment.id, user_id=user_id).first()
-    else:
-        vote = CommentVote.query.filter_by(comment_id=comment.id, session_id=session_id).first()
+    voter = f"user:{user_id}" if user_id else f"session:{session_id}"
 
-    if vote:
-        if vote.action == action:
-            db.session.delete(vote)  # bấm lại -> hủy
+    # Bấm lại -> hủy vote. Ràng buộc unique (comment_id, voter) chống vote trùng khi bấm đồng thời,
+    # số like được cộng/trừ nguyên tử nên không cần COUNT(*) lại toàn bộ vote
+    try:
+        removed = CommentVote.query.filter_by(comment_id=comment.id, voter=voter)\
+            .delete(synchronize_session=False)
+        if removed:
+            delta = -1
         else:
-            vote.action = action     # đổi like <-> dislike
-    else:
-        vote = CommentVote(
-            comment_id=comment.id,
-            user_id=user_id,
-            session_id=session_id if not user_id else None,
-            action=action
-        )
-        db.session.add(vote)
+            inserted = db.session.execute(
+                mysql_insert(CommentVote).prefix_with("IGNORE").values(
+                    comment_id=comment.id,
+                    voter=voter,
+                    user_id=user_id,
+                    session_id=session_id if not user_id else None,
+                    action=action,
+                    created_at=datetime.now()
+                )
+            ).rowcount
+            delta = 1 if inserted else 0
 
-    db.session.commit()
+        if delta:
+            Comment.query.filter_by(id=comment.id).update(
+                {Comment.likes: func.coalesce(Comment.likes, 0) + delta},
+                synchronize_session=False
+            )
+        likes = db.session.query(Comment.likes).filter_by(id=comment.id).scalar() or 0
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
 
-    likes = CommentVote.query.filter_by(comment_id=comment.id, action="like").count()
-    comment.likes = likes
-    db.session.commit()
     resp = make_response(jsonify({"likes": likes}))
     # Nếu guest thì set cookie lưu lại session_id
     if not user_id:
@@ -799,6 +910,7 @@ def get_orders():
 
 
 @main.route("/admin/login", methods=["POST"])
+@rate_limit("admin-login", 10, 60, key="ip")
 def admin_login():
     data = request.get_json()
     username = data.get("username")
@@ -807,8 +919,10 @@ def admin_login():
     user = User.query.filter_by(username=username).first()
     if not user or user.role not in [UserRole.ADMIN, UserRole.STAFF] or not user.check_password(password):
         return jsonify({"error": "Sai username hoặc password"}), 401
+    if user.upgrade_password_hash(password):
+        db.session.commit()
 
-    token = create_access_token(identity=str(user.id))
+    token = create_user_token(user)
     return jsonify({"token": token, "username": user.username, "role": user.role.value})
 
 
@@ -876,11 +990,39 @@ def create_user():
         "role": user.role.value
     }), 201
 
+@main.route("/admin/users/import", methods=["POST"])
+@admin_required
+def import_users():
+    # Nhận file CSV / NDJSON (đọc dần theo dòng) hoặc mảng JSON trong body
+    upload = request.files.get("file")
+    if upload:
+        filename = (upload.filename or "").lower()
+        stream = upload.stream
+        is_ndjson = filename.endswith((".ndjson", ".jsonl"))
+        is_csv = not is_ndjson
+    else:
+        content_type = request.mimetype or ""
+        stream = request.stream
+        is_ndjson = content_type in ["application/x-ndjson", "application/jsonl"]
+        is_csv = content_type == "text/csv"
+
+    if is_csv:
+        rows = iter_csv_rows(stream)
+    elif is_ndjson:
+        rows = iter_ndjson_rows(stream)
+    else:
+        data = request.get_json(silent=True)
+        if not isinstance(data, list):
+            return jsonify({"error": "Dữ liệu phải là file CSV/NDJSON hoặc mảng JSON"}), 400
+        rows = data
+
+    result = UserImporter().run(rows)
+    return jsonify(result), 200
+
 @main.route("/admin/users/<int:user_id>", methods=["PUT"])
 @staff_required
 def update_user(user_id):
-    current_user_id = get_jwt_identity()
-    current_user = User.query.get(current_user_id)
+    current_user = get_current_user()
     user = User.query.get_or_404(user_id)
 
     data = request.get_json()
@@ -893,11 +1035,19 @@ def update_user(user_id):
     if "email" in data:
         user.email = data["email"]
     if "role" in data:
-        user.role = data["role"]
+        try:
+            new_role = UserRole(data["role"])
+        except ValueError:
+            return jsonify({"error": "Role không hợp lệ"}), 400
+        # Hạ quyền thì token cũ (đang mang quyền cũ) phải bị thu hồi ngay
+        if ROLE_RANK[new_role] < ROLE_RANK[user.role]:
+            token_revocation.revoke_user(user.id)
+        user.role = new_role
     if "password" in data and data["password"].strip():
         user.set_password(data["password"])
 
     db.session.commit()
+    invalidate_user_cache(user.id)
     return jsonify({"message": "Cập nhật user thành công"}), 200
 
 @main.route("/admin/users/<int:user_id>", methods=["DELETE"])
@@ -905,7 +1055,9 @@ def update_user(user_id):
 def delete_user(user_id):
     user = User.query.get_or_404(user_id)
     db.session.delete(user)
+    token_revocation.revoke_user(user_id)
     db.session.commit()
+    invalidate_user_cache(user_id)
     return jsonify({"message": "Xóa user thành công"}), 200
 
 
@@ -1341,8 +1493,7 @@ def reply_comment(comment_id):
     comment = Comment.query.get(comment_id)
     if not comment:
         return jsonify({"error": "Không tìm thấy bình luận"}), 404
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = get_current_user()
 
     # Lưu trả lời vào cột admin_reply
     comment.admin_reply = reply_content
@@ -1409,6 +1560,41 @@ def sales_by_product():
 
 
 
+@main.route("/admin/sales/timeseries", methods=["GET"])
+@staff_required
+def sales_timeseries_view():
+    granularity = request.args.get("granularity", "day")
+    if granularity not in ["day", "week"]:
+        return jsonify({"error": "granularity phải là day hoặc week"}), 400
+
+    try:
+        end = datetime.strptime(request.args["to"], "%Y-%m-%d").date() if request.args.get("to") \
+            else datetime.now().date()
+        start = datetime.strptime(request.args["from"], "%Y-%m-%d").date() if request.args.get("from") \
+            else end - timedelta(days=29 if granularity == "day" else 7 * 11)
+    except ValueError:
+        return jsonify({"error": "Ngày phải có dạng YYYY-MM-DD"}), 400
+
+    if start > end:
+        return jsonify({"error": "Ngày bắt đầu phải trước ngày kết thúc"}), 400
+    if (end - start).days > 730:
+        return jsonify({"error": "Khoảng thời gian tối đa là 2 năm"}), 400
+
+    window = request.args.get("window", 7 if granularity == "day" else 4, type=int)
+    window = max(1, min(window, 90))
+    brand_id = request.args.get("brand_id", 0, type=int)
+    category_id = request.args.get("category_id", 0, type=int)
+
+    points = sales_timeseries(start, end, granularity, window, brand_id, category_id)
+    return jsonify({
+        "granularity": granularity,
+        "window": window,
+        "brand_id": brand_id or None,
+        "category_id": category_id or None,
+        "points": points
+    })
+
+
 @main.route("/api/create_momo_payment/<int:order_id>", methods=["POST"])
 def create_momo_payment(order_id):
     order = Order.query.get_or_404(order_id)
@@ -1464,6 +1650,7 @@ def payment_callback_confirm(order_id):
             # Thanh toán thành công
             order.status = OrderStatus.PAID
             order.delivery_status = DeliveryStatus.PROCESSING
+            record_order_sales(order)
 
             # Giảm stock từng sản phẩm
             for item in order.items:  # giả sử order.items liên kết đến OrderItem
@@ -1555,15 +1742,18 @@ def create_order_from_cart():
         )
         db.session.add(order_item)
 
+    record_purchases(order, product_ids)
     CartItem.query.filter(
         CartItem.user_id == user_id,
         CartItem.product_id.in_(product_ids)
     ).delete(synchronize_session=False)
     db.session.commit()
+    cart_cache.invalidate(user_id)
     return jsonify({"order_id": order.id, "total_price": total_price}), 201
 
 
 @main.route("/chatbot", methods=["POST"])
+@rate_limit("chatbot", 20, 60, key="user", algorithm="token_bucket")
 def chatbot():
     data = request.get_json()
     message = data.get("message", "").strip()
@@ -1572,27 +1762,26 @@ def chatbot():
         return jsonify({"error": "Message is required"}), 400
 
     try:
-        # ===== 1️⃣ NẠP NGỮ CẢNH TỪ DATABASE =====
-        products = Product.query.join(Brand).join(Category).all()
-        product_context = "\n".join([
-            f"- {p.name} ({p.category.name if p.category else 'Không rõ'} - {p.brand.name if p.brand else 'Không rõ'}): "
-            f"Giá {p.price:,.0f}₫, RAM {p.ram}, CPU {p.cpu}, bộ nhớ {p.storage}, "
-            f"màn hình {p.screen}, pin {p.battery}, màu {p.color}."
-            for p in products[:30]
-        ])
+        # Câu hỏi thường gặp / đã trả lời gần đây -> trả lời ngay, không gọi model
+        cached = chat_response_cache.lookup(message)
+        if cached:
+            return jsonify({"response": cached})
+
+        # ===== 1️⃣ NẠP NGỮ CẢNH: các sản phẩm liên quan tới câu hỏi (chỉ mục cache theo phiên bản catalog) =====
+        context = relevant_product_context(message)
 
         context_prompt = f"""
         Bạn là chatbot tư vấn bán hàng của Cửa hàng điện tử PhuStore.
-        - Địa chỉ: 35c đường 109, Phước Long B, Quận 9, TP.HCM.
-        - Bảo hành sản phẩm: 12 tháng tiêu chuẩn, đổi mới 7 ngày nếu lỗi nhà sản xuất.
+        - Địa chỉ: {SHOP_ADDRESS}.
+        - Bảo hành sản phẩm: {SHOP_WARRANTY}.
         - Sản phẩm gồm: điện thoại, laptop và phụ kiện công nghệ.
         - Khi được hỏi về giá, sản phẩm, thương hiệu → hãy trả lời dựa trên dữ liệu có sẵn bên dưới.
         - Nếu người dùng hỏi các câu xã giao (như “khỏe không”, “hôm nay ngày mấy”, “bạn là ai”) → hãy trả lời thân thiện, ngắn gọn.
         - Nếu câu hỏi không liên quan đến sản phẩm → vẫn cố gắng trả lời một cách tự nhiên.
-        - Hotline: 0123456789
+        - Hotline: {SHOP_HOTLINE}
 
         Dưới đây là dữ liệu sản phẩm trong cửa hàng:
-        {product_context}
+        {context}
 
         Câu hỏi của khách hàng: {message}
         """
@@ -1622,6 +1811,8 @@ def chatbot():
 
         if not reply:
             reply = "Xin lỗi, tôi chưa hiểu câu hỏi của bạn. Bạn có thể nói rõ hơn không ạ?"
+        else:
+            chat_response_cache.store(message, reply)
 
         return jsonify({"response": reply})
 
@@ -1640,6 +1831,7 @@ def mask_email(email):
 
 
 @main.route("/request-otp", methods=["POST"])
+@rate_limit("request-otp", 10, 300, key="ip")
 def request_otp():
     data = request.get_json()
     phone = data.get("phone")
@@ -1648,6 +1840,13 @@ def request_otp():
     if not phone:
         return jsonify({"error": "Vui lòng nhập số điện thoại"}), 400
 
+    # Giới hạn số lần gửi theo số điện thoại để không bị spam mail
+    allowed, retry_after = otp_store.allow_send(phone)
+    if not allowed:
+        response = jsonify({"error": f"Bạn đã yêu cầu OTP quá nhiều lần, vui lòng thử lại sau {retry_after} giây"})
+        response.headers["Retry-After"] = str(retry_after)
+        return response, 429
+
     if otp_type == "password_reset":
         user = User.query.filter_by(phone=phone).first()
         if not user or not user.email:
@@ -1659,24 +1858,16 @@ def request_otp():
             return jsonify({"error": "Không tìm thấy email cho số điện thoại này"}), 404
         email = order.guest_email
 
-    # Tạo OTP và expiry
+    # Tạo OTP mới (ghi đè mã cũ nếu có)
     otp_code = str(random.randint(100000, 999999))
-    expiry = datetime.now() + timedelta(minutes=5)
-
-    # Xoá OTP cũ nếu có
-    OTP.query.filter_by(phone=phone).delete()
-
-    # Lưu OTP mới
-    otp_entry = OTP(phone=phone, otp_code=otp_code, expiry=expiry)
-    db.session.add(otp_entry)
-    db.session.commit()
+    otp_store.save(phone, otp_code)
 
     # Gửi mail OTP
     try:
         msg = Message(
             subject="Mã OTP xác thực",
             recipients=[email],
-            body=f"Mã OTP của bạn là: {otp_code}\nMã có hiệu lực trong 5 phút."
+            body=f"Mã OTP của bạn là: {otp_code}\nMã có hiệu lực trong {OTP_TTL // 60} phút."
         )
         mail.send(msg)
     except Exception as e:
@@ -1702,10 +1893,7 @@ def verify_otp():
     if not phone or not code:
         return jsonify({"error": "Vui lòng nhập đủ thông tin"}), 400
 
-    otp_entry = OTP.query.filter_by(phone=phone).first()
-    print(f"OTP from DB: {otp_entry.otp_code}, OTP input: {code}")
-    print(f"Now: {datetime.now()}, Expiry: {otp_entry.expiry}")
-    if not otp_entry or not otp_entry.is_valid(code):
+    if not otp_store.verify(phone, code):
         return jsonify({"error": "Mã OTP không hợp lệ hoặc đã hết hạn"}), 400
 
     return jsonify({"message": "Xác thực OTP thành công"}), 200
@@ -1721,16 +1909,15 @@ def reset_password():
     if not phone or not otp_code or not new_password:
         return jsonify({"error": "Vui lòng nhập đủ thông tin"}), 400
 
-    otp_entry = OTP.query.filter_by(phone=phone).first()
-    if not otp_entry or not otp_entry.is_valid(otp_code):
-        return jsonify({"error": "Mã OTP không hợp lệ hoặc đã hết hạn"}), 400
-
     user = User.query.filter_by(phone=phone).first()
     if not user:
         return jsonify({"error": "Người dùng không tồn tại"}), 404
 
+    # OTP chỉ dùng được 1 lần để đổi mật khẩu
+    if not otp_store.verify(phone, otp_code, consume=True):
+        return jsonify({"error": "Mã OTP không hợp lệ hoặc đã hết hạn"}), 400
+
     user.set_password(new_password)
-    db.session.delete(otp_entry)  # Xóa OTP sau khi sử dụng
     db.session.commit()
 
     return jsonify({"message": "Đổi mật khẩu thành công"}), 200
@@ -1744,12 +1931,8 @@ def google_login():
         return jsonify({"error": "Thiếu id_token"}), 400
 
     try:
-        # Dùng Request() của google.auth.transport
-        idinfo = id_token.verify_oauth2_token(
-            id_token_received,
-            google_requests.Request(),
-            GOOGLE_CLIENT_ID
-        )
+        # Xác thực ngay tại server bằng chứng chỉ Google đã cache
+        idinfo = verify_google_id_token(id_token_received, GOOGLE_CLIENT_ID)
 
         email = idinfo.get("email")
         sub = idinfo.get("sub")
@@ -1760,12 +1943,12 @@ def google_login():
                 username=email.split("@")[0],
                 email=email,
                 role=UserRole.CUSTOMER,
-                password_hash=generate_password_hash(sub),
+                password_hash=password_hasher.hash(sub),
             )
             db.session.add(user)
             db.session.commit()
 
-        access_token = create_access_token(identity=str(user.id))
+        access_token = create_user_token(user)
 
         return jsonify({
             "access_token": access_token,
@@ -1775,6 +1958,8 @@ def google_login():
         })
     except ValueError:
         return jsonify({"error": "Token không hợp lệ"}), 400
+    except GoogleCertsUnavailable:
+        return jsonify({"error": "Không thể xác thực với Google, vui lòng thử lại sau"}), 503
 
 @main.route("/api/pay_cod/<int:order_id>", methods=["POST"])
 def pay_cod(order_id):
@@ -1816,6 +2001,7 @@ def update_payment_status(order_id):
     if new_status not in OrderStatus.__members__:
         return jsonify({"error": "Trạng thái thanh toán không hợp lệ"}), 400
 
+    on_order_status_change(order, order.status, OrderStatus[new_status])
     order.status = OrderStatus[new_status]
     db.session.commit()
 
@@ -1890,11 +2076,11 @@ def change_password():
         return jsonify({"error": "Người dùng không tồn tại"}), 404
 
     # Kiểm tra mật khẩu cũ
-    if not check_password_hash(user.password_hash, old_password):
+    if not user.check_password(old_password):
         return jsonify({"error": "Mật khẩu cũ không đúng"}), 400
 
     # Cập nhật mật khẩu mới
-    user.password_hash = generate_password_hash(new_password)
+    user.set_password(new_password)
     db.session.commit()
 
     return jsonify({"message": "Đổi mật khẩu thành công"}), 200
@@ -1927,20 +2113,25 @@ def admin_get_comments():
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 10, type=int)
     search = request.args.get('search', '', type=str)
+    status = request.args.get('status', '', type=str).strip().upper()
 
-    query = Comment.query.join(Product, isouter=True).order_by(Comment.created_at.desc())
+    # Product lấy luôn trong cùng câu JOIN, user nạp kèm -> số truy vấn cố định mỗi trang
+    query = Comment.query.join(Product, isouter=True)\
+        .options(contains_eager(Comment.product), joinedload(Comment.user).load_only(User.username))\
+        .order_by(Comment.created_at.desc())
 
     if search:
         query = query.filter(Product.name.ilike(f"%{search}%"))
+    if status in CommentStatus.__members__:
+        query = query.filter(Comment.status == CommentStatus[status])
 
     pagination = query.paginate(page=page, per_page=per_page, error_out=False)
     comments = pagination.items
+    first_images = first_image_urls({c.product_id for c in comments})
 
     result = []
     for c in comments:
-        first_image = None
-        if c.product and c.product.images:
-            first_image = c.product.images[0].url
+        first_image = first_images.get(c.product_id)
 
         result.append({
             "id": c.id,
@@ -1954,6 +2145,7 @@ def admin_get_comments():
             "admin_reply": c.admin_reply,
             "created_at": c.created_at.strftime("%Y-%m-%d %H:%M:%S"),
             "likes": c.likes or 0,
+            "status": c.status.value,
         })
 
     return jsonify({
@@ -1969,6 +2161,8 @@ def admin_get_comments():
 def delete_comment(comment_id):
     comment = Comment.query.get_or_404(comment_id)
     try:
+        if comment.status == CommentStatus.APPROVED:
+            update_rating_summary(comment.product_id, comment.rating, sign=-1)
         db.session.delete(comment)
         db.session.commit()
         return jsonify({"message": f"Bình luận {comment_id} đã được xóa thành công."}), 200
@@ -1976,6 +2170,52 @@ def delete_comment(comment_id):
         db.session.rollback()
         return jsonify({"error": "Xóa bình luận thất bại.", "details": str(e)}), 500
 
+@main.errorhandler(PasswordHasherBusy)
+def password_hasher_busy(e):
+    response = jsonify({"error": str(e)})
+    response.headers["Retry-After"] = "1"
+    return response, 503
+
+@main.route("/admin/auth/password-hash/stats", methods=["GET"])
+@admin_required
+def password_hash_stats():
+    return jsonify(password_hasher.stats())
+
+@main.route("/admin/auth/revocation/stats", methods=["GET"])
+@admin_required
+def revocation_stats():
+    return jsonify(token_revocation.stats())
+
+@main.route("/admin/chatbot/stats", methods=["GET"])
+@staff_required
+def chatbot_stats():
+    return jsonify(chat_response_cache.stats())
+
+@main.route("/admin/moderation/stats", methods=["GET"])
+@staff_required
+def moderation_stats():
+    return jsonify({
+        "queue_size": moderation_queue.qsize(),
+        "verdict_cache": verdict_cache.stats()
+    })
+
+@main.route("/admin/comments/<int:comment_id>/status", methods=["PUT"])
+@staff_required
+def update_comment_status(comment_id):
+    data = request.json
+    new_status = data.get("status")
+    if new_status not in CommentStatus.__members__:
+        return jsonify({"error": "Trạng thái bình luận không hợp lệ"}), 400
+
+    comment = Comment.query.get_or_404(comment_id)
+    try:
+        set_comment_status(comment, CommentStatus[new_status])
+        db.session.commit()
+        return jsonify({"id": comment.id, "status": comment.status.value}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": "Cập nhật trạng thái thất bại.", "details": str(e)}), 500
+
 @main.route("/admin/comments/<int:comment_id>/reply", methods=["PUT"])
 @staff_required
 def update_admin_reply(comment_id):
@@ -2142,6 +2382,52 @@ def update_stockin(id):
     db.session.commit()
     return jsonify({"message": "Cập nhật nhập kho thành công"})
 
+@main.route("/admin/inventory/forecast", methods=["GET"])
+@staff_required
+def inventory_forecast():
+    page = request.args.get("page", 1, type=int)
+    per_page = request.args.get("per_page", 20, type=int)
+    only_reorder = request.args.get("only_reorder", "false").lower() == "true"
+    search = request.args.get("search", "", type=str).strip()
+
+    query = InventoryForecast.query.join(Product).options(contains_eager(InventoryForecast.product))
+    if only_reorder:
+        query = query.filter(InventoryForecast.needs_reorder.is_(True))
+    if search:
+        query = query.filter(Product.name.ilike(f"%{search}%"))
+
+    # Sản phẩm sắp hết hàng lên đầu, sản phẩm không bán được xuống cuối
+    query = query.order_by(
+        InventoryForecast.days_of_cover.is_(None),
+        InventoryForecast.days_of_cover.asc()
+    )
+    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+
+    result = []
+    for f in pagination.items:
+        result.append({
+            "product_id": f.product_id,
+            "product_name": f.product.name,
+            "stock": f.stock,
+            "velocity": round(f.velocity, 3),
+            "velocity_std": round(f.velocity_std, 3),
+            "safety_stock": round(f.safety_stock, 1),
+            "reorder_point": round(f.reorder_point, 1),
+            "days_of_cover": round(f.days_of_cover, 1) if f.days_of_cover is not None else None,
+            "stockout_date": f.stockout_date.strftime("%Y-%m-%d") if f.stockout_date else None,
+            "suggested_quantity": f.suggested_quantity,
+            "needs_reorder": f.needs_reorder,
+            "computed_at": f.computed_at.strftime("%Y-%m-%d %H:%M:%S") if f.computed_at else None
+        })
+
+    return jsonify({
+        "forecasts": result,
+        "total": pagination.total,
+        "page": pagination.page,
+        "per_page": pagination.per_page,
+        "pages": pagination.pages
+    })
+
 @main.route("/admin/stockin/<int:id>/logs", methods=["GET"])
 @staff_required
 def get_stockin_logs(id):
@@ -0,0 +1,192 @@
+import json
+import os
+import shutil
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import func
+
+from . import db
+from .models import Order, OrderItem, OrderStatus, DeliveryStatus
+
+# Snapshot dạng cột của đơn hàng cho phân tích offline.
+# Mỗi lần chạy ghi một "thế hệ" (generation) mới, các file đã ghi không bao giờ bị sửa,
+# nên process khác đang mmap thế hệ cũ vẫn đọc được an toàn.
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots")
+MANIFEST_NAME = "manifest.json"
+# Số thế hệ giữ lại sau mỗi lần ghi, 0 = giữ tất cả
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", 5))
+CHUNK_SIZE = 10000
+
+STATUS_CODES = [s.value for s in OrderStatus]
+DELIVERY_CODES = [s.value for s in DeliveryStatus]
+
+# (tên cột, dtype, cột SQL, kiểu mã hóa)
+ORDER_COLUMNS = [
+    ("id", "int64", Order.id, "int"),
+    ("user_id", "int64", Order.user_id, "int"),  # -1 nếu là khách vãng lai
+    ("created_at", "int64", Order.created_at, "time"),  # epoch giây
+    ("total_price", "float64", Order.total_price, "float"),
+    ("status", "int8", Order.status, "status"),
+    ("delivery_status", "int8", Order.delivery_status, "delivery"),
+]
+
+ITEM_COLUMNS = [
+    ("id", "int64", OrderItem.id, "int"),
+    ("order_id", "int64", OrderItem.order_id, "int"),
+    ("product_id", "int64", OrderItem.product_id, "int"),
+    ("quantity", "int32", OrderItem.quantity, "int"),
+    ("unit_price", "float64", OrderItem.unit_price, "float"),
+    # Lặp lại thông tin đơn để lọc theo ngày / trạng thái mà không cần join
+    ("created_at", "int64", Order.created_at, "time"),
+    ("status", "int8", Order.status, "status"),
+]
+
+
+def _encode(value, kind):
+    if value is None:
+        return -1 if kind != "float" else np.nan
+    if kind == "time":
+        return int(value.timestamp())
+    if kind == "status":
+        return STATUS_CODES.index(value.value)
+    if kind == "delivery":
+        return DELIVERY_CODES.index(value.value)
+    return value
+
+
+def _write_table(path, query, columns):
+    os.makedirs(path, exist_ok=True)
+    rows = query.count()
+
+    arrays = {}
+    for name, dtype, _, _ in columns:
+        file_path = os.path.join(path, f"{name}.npy")
+        if rows == 0:
+            np.save(file_path, np.empty(0, dtype=dtype))
+        else:
+            arrays[name] = np.lib.format.open_memmap(file_path, mode="w+", dtype=dtype, shape=(rows,))
+
+    if rows:
+        offset = 0
+        buffer = []
+        for row in query.yield_per(CHUNK_SIZE):
+            buffer.append(row)
+            if len(buffer) == CHUNK_SIZE:
+                _flush_chunk(arrays, columns, buffer, offset)
+                offset += len(buffer)
+                buffer = []
+        if buffer:
+            _flush_chunk(arrays, columns, buffer, offset)
+        for arr in arrays.values():
+            arr.flush()
+
+    return {
+        "rows": rows,
+        "columns": {name: dtype for name, dtype, _, _ in columns},
+    }
+
+
+def _flush_chunk(arrays, columns, rows, offset):
+    end = offset + len(rows)
+    for i, (name, dtype, _, kind) in enumerate(columns):
+        arrays[name][offset:end] = np.fromiter(
+            (_encode(r[i], kind) for r in rows), dtype=dtype, count=len(rows)
+        )
+
+
+def load_manifest(root=SNAPSHOT_DIR):
+    path = os.path.join(root, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {"latest": None, "generations": []}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_manifest(root, manifest):
+    tmp_path = os.path.join(root, MANIFEST_NAME + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    # Thay thế nguyên tử để reader không bao giờ đọc manifest ghi dở
+    os.replace(tmp_path, os.path.join(root, MANIFEST_NAME))
+
+
+def write_order_snapshot(root=SNAPSHOT_DIR, keep=SNAPSHOT_KEEP):
+    """
+    Ghi một thế hệ snapshot mới của orders và order_items, trả về metadata của thế hệ đó.
+    Chỉ giữ lại `keep` thế hệ mới nhất (0 = giữ tất cả).
+    """
+    os.makedirs(root, exist_ok=True)
+    name = datetime.now().strftime("%Y%m%dT%H%M%S%f")
+    tmp_dir = os.path.join(root, name + ".tmp")
+    final_dir = os.path.join(root, name)
+
+    # Chốt mốc order id để orders và order_items nhất quán với nhau
+    max_order_id = db.session.query(func.max(Order.id)).scalar() or 0
+
+    orders_query = (
+        db.session.query(*[c[2] for c in ORDER_COLUMNS])
+        .filter(Order.id <= max_order_id)
+        .order_by(Order.id)
+    )
+    items_query = (
+        db.session.query(*[c[2] for c in ITEM_COLUMNS])
+        .join(Order, Order.id == OrderItem.order_id)
+        .filter(OrderItem.order_id <= max_order_id)
+        .order_by(OrderItem.id)
+    )
+
+    try:
+        tables = {
+            "orders": _write_table(os.path.join(tmp_dir, "orders"), orders_query, ORDER_COLUMNS),
+            "order_items": _write_table(os.path.join(tmp_dir, "order_items"), items_query, ITEM_COLUMNS),
+        }
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    finally:
+        db.session.rollback()
+
+    os.rename(tmp_dir, final_dir)
+
+    generation = {
+        "name": name,
+        "created_at": datetime.now().isoformat(),
+        "max_order_id": max_order_id,
+        "tables": tables,
+        "codes": {"status": STATUS_CODES, "delivery_status": DELIVERY_CODES},
+    }
+    manifest = load_manifest(root)
+    manifest["generations"].append(generation)
+    manifest["latest"] = name
+    expired = []
+    if keep > 0 and len(manifest["generations"]) > keep:
+        expired = manifest["generations"][:-keep]
+        manifest["generations"] = manifest["generations"][-keep:]
+    _save_manifest(root, manifest)
+
+    # Xóa thư mục sau khi manifest không còn trỏ tới; process đang mmap file cũ vẫn đọc được tới khi đóng
+    for old in expired:
+        shutil.rmtree(os.path.join(root, old["name"]), ignore_errors=True)
+    return generation
+
+
+def open_order_snapshot(root=SNAPSHOT_DIR, generation=None):
+    """
+    Mở snapshot ở chế độ chỉ đọc, các cột được mmap (zero-copy, chia sẻ page cache giữa các process).
+    Trả về dict: {"orders": {cột: ndarray}, "order_items": {...}, "meta": metadata thế hệ}
+    """
+    manifest = load_manifest(root)
+    name = generation or manifest["latest"]
+    meta = next((g for g in manifest["generations"] if g["name"] == name), None)
+    if meta is None:
+        raise FileNotFoundError(f"Không tìm thấy snapshot '{name}' trong {root}")
+
+    result = {"meta": meta}
+    for table, table_meta in meta["tables"].items():
+        table_dir = os.path.join(root, name, table)
+        result[table] = {
+            col: np.load(os.path.join(table_dir, f"{col}.npy"), mmap_mode="r" if table_meta["rows"] else None)
+            for col in table_meta["columns"]
+        }
+    return result
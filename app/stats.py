@@ -0,0 +1,306 @@
+import heapq
+from collections import defaultdict, deque
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import func, literal
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+
+from . import db
+from .cache import TTLCache
+from .models import Category, DailySales, Order, OrderItem, OrderStatus, Product, ProductSales
+from .utils import first_image_urls
+
+PERIODS = ["day", "week", "month", "all"]
+ALL_TIME_BUCKET = date(1970, 1, 1)
+
+# Kết quả top sản phẩm được cache theo (period, category, n, kind)
+top_products_cache = TTLCache(maxsize=256, ttl=60)
+
+
+def period_bucket(period, day):
+    if period == "day":
+        return day
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    if period == "month":
+        return day.replace(day=1)
+    return ALL_TIME_BUCKET
+
+
+def _sales_keys(brand_id, category_id):
+    return {(0, 0), (brand_id, 0), (0, category_id), (brand_id, category_id)}
+
+
+def record_order_sales(order, sign=1):
+    """
+    Cộng (sign=1) hoặc trừ (sign=-1) doanh số của một đơn vào bảng daily_sales.
+    Gọi trong cùng transaction với thao tác đổi trạng thái đơn, trước khi commit.
+    """
+    items = (
+        db.session.query(OrderItem.product_id, OrderItem.quantity, OrderItem.unit_price,
+                         Product.brand_id, Product.category_id)
+        .join(Product, Product.id == OrderItem.product_id)
+        .filter(OrderItem.order_id == order.id)
+        .all()
+    )
+    if not items:
+        return
+
+    buckets = defaultdict(lambda: [0.0, 0])  # (brand_id, category_id) -> [revenue, units]
+    product_units = defaultdict(int)  # (product_id, category_id) -> units
+    for product_id, quantity, unit_price, brand_id, category_id in items:
+        for key in _sales_keys(brand_id, category_id):
+            buckets[key][0] += quantity * unit_price
+            buckets[key][1] += quantity
+        product_units[(product_id, category_id)] += quantity
+
+    day = order.created_at.date()
+    rows = [
+        {
+            "day": day,
+            "brand_id": brand_id,
+            "category_id": category_id,
+            "revenue": sign * revenue,
+            "units": sign * units,
+            "orders": sign,
+        }
+        for (brand_id, category_id), (revenue, units) in buckets.items()
+    ]
+    stmt = mysql_insert(DailySales).values(rows)
+    stmt = stmt.on_duplicate_key_update(
+        revenue=DailySales.revenue + stmt.inserted.revenue,
+        units=DailySales.units + stmt.inserted.units,
+        orders=DailySales.orders + stmt.inserted.orders,
+    )
+    db.session.execute(stmt)
+
+    counter_rows = [
+        {
+            "product_id": product_id,
+            "category_id": category_id,
+            "period": period,
+            "bucket": period_bucket(period, day),
+            "units": sign * units,
+        }
+        for (product_id, category_id), units in product_units.items()
+        for period in PERIODS
+    ]
+    stmt = mysql_insert(ProductSales).values(counter_rows)
+    stmt = stmt.on_duplicate_key_update(units=ProductSales.units + stmt.inserted.units)
+    db.session.execute(stmt)
+    top_products_cache.clear()
+
+
+def on_order_status_change(order, old_status, new_status):
+    if old_status != OrderStatus.PAID and new_status == OrderStatus.PAID:
+        record_order_sales(order, sign=1)
+    elif old_status == OrderStatus.PAID and new_status != OrderStatus.PAID:
+        record_order_sales(order, sign=-1)
+
+
+def rebuild_daily_sales():
+    """Tính lại toàn bộ bảng daily_sales từ các đơn đã thanh toán (dùng khi backfill)."""
+    day = func.date(Order.created_at)
+    zero = literal(0)
+    groupings = [
+        (zero, zero),
+        (Product.brand_id, zero),
+        (zero, Product.category_id),
+        (Product.brand_id, Product.category_id),
+    ]
+
+    DailySales.query.delete()
+    total = 0
+    for brand_col, category_col in groupings:
+        group_cols = [day] + [c for c in (brand_col, category_col) if c is not zero]
+        results = (
+            db.session.query(
+                day,
+                brand_col,
+                category_col,
+                func.sum(OrderItem.quantity * OrderItem.unit_price),
+                func.sum(OrderItem.quantity),
+                func.count(func.distinct(Order.id)),
+            )
+            .join(OrderItem, Order.id == OrderItem.order_id)
+            .join(Product, Product.id == OrderItem.product_id)
+            .filter(Order.status == OrderStatus.PAID)
+            .group_by(*group_cols)
+            .all()
+        )
+        db.session.bulk_insert_mappings(DailySales, [
+            {
+                "day": r[0],
+                "brand_id": r[1],
+                "category_id": r[2],
+                "revenue": float(r[3] or 0),
+                "units": int(r[4] or 0),
+                "orders": int(r[5] or 0),
+            }
+            for r in results
+        ])
+        total += len(results)
+    db.session.commit()
+    return total
+
+
+def rebuild_product_sales():
+    """Tính lại bảng product_sales từ các đơn đã thanh toán."""
+    results = (
+        db.session.query(
+            func.date(Order.created_at),
+            OrderItem.product_id,
+            Product.category_id,
+            func.sum(OrderItem.quantity),
+        )
+        .join(OrderItem, Order.id == OrderItem.order_id)
+        .join(Product, Product.id == OrderItem.product_id)
+        .filter(Order.status == OrderStatus.PAID)
+        .group_by(func.date(Order.created_at), OrderItem.product_id, Product.category_id)
+        .all()
+    )
+
+    counters = defaultdict(int)
+    for day, product_id, category_id, units in results:
+        if isinstance(day, str):
+            day = datetime.strptime(day, "%Y-%m-%d").date()
+        for period in PERIODS:
+            counters[(period, period_bucket(period, day), product_id, category_id)] += int(units or 0)
+
+    ProductSales.query.delete()
+    db.session.bulk_insert_mappings(ProductSales, [
+        {"period": period, "bucket": bucket, "product_id": product_id, "category_id": category_id, "units": units}
+        for (period, bucket, product_id, category_id), units in counters.items()
+    ])
+    db.session.commit()
+    top_products_cache.clear()
+    return len(counters)
+
+
+def top_products(period="week", category=None, n=10, slow=False):
+    """
+    Top n sản phẩm bán chạy (hoặc bán chậm nếu slow=True) trong kỳ hiện tại.
+    Đọc bộ đếm product_sales của đúng 1 bucket rồi chọn bằng heap, không join order_items.
+    """
+    cache_key = (period, category, n, slow)
+    cached = top_products_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    category_id = None
+    if category:
+        category_id = db.session.query(Category.id).filter(Category.name == category).scalar()
+        if category_id is None:
+            top_products_cache.set(cache_key, [])
+            return []
+
+    counter_query = db.session.query(ProductSales.product_id, ProductSales.units).filter(
+        ProductSales.period == period,
+        ProductSales.bucket == period_bucket(period, datetime.now().date()),
+    )
+    if category_id:
+        counter_query = counter_query.filter(ProductSales.category_id == category_id)
+    units_by_product = dict(counter_query.all())
+
+    if slow:
+        # Bán chậm phải tính cả sản phẩm chưa bán được cái nào trong kỳ
+        id_query = db.session.query(Product.id)
+        if category_id:
+            id_query = id_query.filter(Product.category_id == category_id)
+        candidates = [pid for (pid,) in id_query.all()]
+        picked = heapq.nsmallest(n, candidates, key=lambda pid: (units_by_product.get(pid, 0), pid))
+    else:
+        picked = [pid for pid, units in heapq.nlargest(
+            n, ((pid, units) for pid, units in units_by_product.items() if units > 0),
+            key=lambda x: (x[1], -x[0])
+        )]
+
+    products = {p.id: p for p in Product.query.filter(Product.id.in_(picked)).all()} if picked else {}
+    images = first_image_urls(picked)
+    result = [
+        {
+            "id": pid,
+            "name": products[pid].name,
+            "price": products[pid].price,
+            "image": images.get(pid),
+            "sold": units_by_product.get(pid, 0),
+        }
+        for pid in picked if pid in products
+    ]
+    top_products_cache.set(cache_key, result)
+    return result
+
+
+def _week_start(d):
+    return d - timedelta(days=d.weekday())
+
+
+def sales_timeseries(start, end, granularity="day", window=7, brand_id=0, category_id=0):
+    """
+    Chuỗi doanh số theo ngày/tuần trong [start, end], kèm trung bình trượt và chênh lệch
+    so với kỳ trước. Chỉ đọc các dòng daily_sales trong khoảng ngày nên chi phí là O(số ngày).
+    """
+    step = 7 if granularity == "week" else 1
+    if granularity == "week":
+        start = _week_start(start)
+        end = _week_start(end)
+
+    # Lấy thêm (window - 1) kỳ phía trước để trung bình trượt của các điểm đầu vẫn đúng
+    warmup_start = start - timedelta(days=step * (window - 1))
+    fetch_end = end + timedelta(days=step - 1)
+
+    rows = DailySales.query.filter(
+        DailySales.brand_id == brand_id,
+        DailySales.category_id == category_id,
+        DailySales.day >= warmup_start,
+        DailySales.day <= fetch_end,
+    ).all()
+
+    buckets = defaultdict(lambda: [0.0, 0, 0])  # revenue, orders, units
+    for r in rows:
+        key = _week_start(r.day) if granularity == "week" else r.day
+        buckets[key][0] += r.revenue
+        buckets[key][1] += r.orders
+        buckets[key][2] += r.units
+
+    points = []
+    revenue_window = deque()
+    orders_window = deque()
+    revenue_sum = 0.0
+    orders_sum = 0
+    prev_revenue = None
+    prev_orders = None
+
+    current = warmup_start
+    while current <= end:
+        revenue, orders, units = buckets.get(current, (0.0, 0, 0))
+
+        # Trung bình trượt cập nhật tăng dần: cộng kỳ mới, trừ kỳ rơi khỏi cửa sổ
+        revenue_window.append(revenue)
+        orders_window.append(orders)
+        revenue_sum += revenue
+        orders_sum += orders
+        if len(revenue_window) > window:
+            revenue_sum -= revenue_window.popleft()
+            orders_sum -= orders_window.popleft()
+
+        if current >= start:
+            revenue_delta = revenue - prev_revenue if prev_revenue is not None else None
+            points.append({
+                "date": current.isoformat(),
+                "revenue": revenue,
+                "orders": orders,
+                "units": units,
+                "revenue_ma": revenue_sum / len(revenue_window),
+                "orders_ma": orders_sum / len(orders_window),
+                "revenue_delta": revenue_delta,
+                "revenue_delta_pct": (revenue_delta / prev_revenue * 100)
+                if prev_revenue else None,
+                "orders_delta": orders - prev_orders if prev_orders is not None else None,
+            })
+
+        prev_revenue = revenue
+        prev_orders = orders
+        current += timedelta(days=step)
+
+    return points
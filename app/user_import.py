@@ -0,0 +1,142 @@
+import csv
+import io
+import json
+import os
+
+from sqlalchemy.exc import IntegrityError
+
+from . import db
+from .models import User, UserRole
+from .passwords import password_hasher
+
+IMPORT_BATCH_SIZE = int(os.getenv("USER_IMPORT_BATCH_SIZE", 500))
+
+
+def iter_csv_rows(stream):
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding="utf-8-sig", newline=""))
+    for row in reader:
+        yield row
+
+
+def iter_ndjson_rows(stream):
+    for line in io.TextIOWrapper(stream, encoding="utf-8-sig"):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None  # dòng hỏng vẫn chiếm số thứ tự để báo lỗi đúng dòng
+
+
+def _clean(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+class UserImporter:
+    """
+    Nhập user hàng loạt: đọc từng lô, kiểm tra trùng username/email/phone của cả lô bằng
+    3 truy vấn IN, băm mật khẩu song song rồi insert cả lô. Lỗi được báo theo từng dòng.
+    """
+
+    def __init__(self, batch_size=IMPORT_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.imported = 0
+        self.errors = []
+        # Giá trị đã dùng bởi các dòng trước trong cùng file
+        self._seen = {"username": set(), "email": set(), "phone": set()}
+
+    def run(self, rows):
+        batch = []
+        for line_no, row in enumerate(rows, start=1):
+            batch.append((line_no, row))
+            if len(batch) >= self.batch_size:
+                self._import_batch(batch)
+                batch = []
+        if batch:
+            self._import_batch(batch)
+        errors = sorted(self.errors, key=lambda e: e["row"])
+        return {"imported": self.imported, "failed": len(errors), "errors": errors}
+
+    def _error(self, line_no, message):
+        self.errors.append({"row": line_no, "error": message})
+
+    def _validate(self, batch):
+        valid = []
+        for line_no, row in batch:
+            if not isinstance(row, dict):
+                self._error(line_no, "Dòng không hợp lệ")
+                continue
+            username = _clean(row.get("username"))
+            email = _clean(row.get("email"))
+            phone = _clean(row.get("phone"))
+            password = row.get("password") or ""
+            if not username or not email or not password:
+                self._error(line_no, "Thiếu username, email hoặc password")
+                continue
+            try:
+                role = UserRole[(_clean(row.get("role")) or "CUSTOMER").upper()]
+            except KeyError:
+                self._error(line_no, f"Role không hợp lệ: {row.get('role')}")
+                continue
+            valid.append((line_no, {"username": username, "email": email, "phone": phone,
+                                    "role": role, "password": password}))
+        return valid
+
+    def _existing(self, column, values):
+        values = {v for v in values if v}
+        if not values:
+            return set()
+        return {v for (v,) in db.session.query(column).filter(column.in_(values)).all()}
+
+    def _import_batch(self, batch):
+        candidates = self._validate(batch)
+        if not candidates:
+            return
+
+        existing = {
+            "username": self._existing(User.username, [c["username"] for _, c in candidates]),
+            "email": self._existing(User.email, [c["email"] for _, c in candidates]),
+            "phone": self._existing(User.phone, [c["phone"] for _, c in candidates]),
+        }
+        labels = {"username": "Username", "email": "Email", "phone": "Số điện thoại"}
+
+        accepted = []
+        for line_no, data in candidates:
+            duplicate = next(
+                (field for field in ("username", "email", "phone")
+                 if data[field] and (data[field] in existing[field] or data[field] in self._seen[field])),
+                None
+            )
+            if duplicate:
+                self._error(line_no, f"{labels[duplicate]} đã tồn tại")
+                continue
+            for field in ("username", "email", "phone"):
+                if data[field]:
+                    self._seen[field].add(data[field])
+            accepted.append((line_no, data))
+        if not accepted:
+            return
+
+        hashes = password_hasher.hash_many([data.pop("password") for _, data in accepted])
+        for (_, data), password_hash in zip(accepted, hashes):
+            data["password_hash"] = password_hash
+
+        try:
+            db.session.bulk_insert_mappings(User, [data for _, data in accepted])
+            db.session.commit()
+            self.imported += len(accepted)
+        except IntegrityError:
+            # Có user được tạo song song trong lúc import -> insert từng dòng để biết dòng nào lỗi
+            db.session.rollback()
+            for line_no, data in accepted:
+                try:
+                    db.session.bulk_insert_mappings(User, [data])
+                    db.session.commit()
+                    self.imported += 1
+                except IntegrityError:
+                    db.session.rollback()
+                    self._error(line_no, "Username, email hoặc số điện thoại đã tồn tại")
@@ -1,12 +1,18 @@
 from datetime import datetime
+from collections import namedtuple
 from flask_mail import Message
-from flask import jsonify
-from . import mail
+from flask import jsonify,g
+from . import mail,db
+from .cache import TTLCache
+import os
 import random
+import re
 import string
-from .models import Order,User,UserRole
+import unicodedata
+from sqlalchemy import func
+from .models import Order,User,UserRole,ProductImage
 from functools import wraps
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt, create_access_token
 def time_ago(dt):
     now = datetime.now()
     diff = now - dt
@@ -23,6 +29,13 @@ def time_ago(dt):
     else:
         return dt.strftime("%Y-%m-%d")
 
+def normalize_text(text):
+    # Chuẩn hóa để so khớp nội dung gần giống nhau: chữ thường, bỏ dấu, bỏ ký tự đặc biệt, gộp khoảng trắng
+    text = unicodedata.normalize("NFD", text or "").casefold().replace("đ", "d")
+    text = "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+    text = re.sub(r"[^\w\s]", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
 def send_order_success_email(user_email, order, is_cod=False):
     # Chuẩn bị chi tiết các sản phẩm
     items_detail = "\n".join(
@@ -120,13 +133,61 @@ def generate_unique_order_code():
         if not existing:
             return code
 
+def first_image_urls(product_ids):
+    # Lấy ảnh đầu tiên của nhiều sản phẩm trong 1 truy vấn -> {product_id: url}
+    if not product_ids:
+        return {}
+    first_ids = db.session.query(func.min(ProductImage.id)) \
+        .filter(ProductImage.product_id.in_(product_ids)) \
+        .group_by(ProductImage.product_id)
+    rows = db.session.query(ProductImage.product_id, ProductImage.url) \
+        .filter(ProductImage.id.in_(first_ids)).all()
+    return {product_id: url for product_id, url in rows}
+
+# Bản chụp thông tin user dùng cho phân quyền, cache theo id để không phải query mỗi request
+UserSnapshot = namedtuple("UserSnapshot", ["id", "username", "email", "role"])
+user_cache = TTLCache(maxsize=int(os.getenv("USER_CACHE_SIZE", 2048)), ttl=int(os.getenv("USER_CACHE_TTL", 60)))
+
+def create_user_token(user):
+    # Role được ký luôn trong token để decorator loại nhanh mà không cần đọc DB
+    return create_access_token(identity=str(user.id), additional_claims={"role": user.role.value})
+
+def get_cached_user(user_id):
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+    snapshot = user_cache.get(user_id)
+    if snapshot is None:
+        user = User.query.get(user_id)
+        if not user:
+            return None
+        snapshot = UserSnapshot(user.id, user.username, user.email, user.role)
+        user_cache.set(user_id, snapshot)
+    return snapshot
+
+def invalidate_user_cache(user_id):
+    user_cache.pop(int(user_id), None)
+
+def get_current_user():
+    # Chỉ lấy 1 lần trong mỗi request, các lần sau đọc lại từ g
+    if "current_user" not in g:
+        g.current_user = get_cached_user(get_jwt_identity())
+    return g.current_user
+
+def _has_role(roles):
+    claim = get_jwt().get("role")
+    if claim is not None and claim not in [r.value for r in roles]:
+        return False
+    # Token có role hợp lệ vẫn phải đối chiếu user hiện tại (đã bị xóa / đổi quyền sau khi cấp token)
+    user = get_current_user()
+    return user is not None and user.role in roles
+
 def admin_required(fn):
     @wraps(fn)
     @jwt_required()
     def wrapper(*args, **kwargs):
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
-        if not user or user.role != UserRole.ADMIN:
+        if not _has_role([UserRole.ADMIN]):
             return jsonify({"error": "Chỉ admin mới truy cập được"}), 403
         return fn(*args, **kwargs)
     return wrapper
@@ -135,9 +196,7 @@ def staff_required(fn):
     @wraps(fn)
     @jwt_required()
     def wrapper(*args, **kwargs):
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
-        if not user or user.role not in [UserRole.ADMIN, UserRole.STAFF]:
+        if not _has_role([UserRole.ADMIN, UserRole.STAFF]):
             return jsonify({"error": "Chỉ admin hoặc nhân viên mới truy cập được"}), 403
         return fn(*args, **kwargs)
     return wrapper
@@ -0,0 +1,68 @@
+from sqlalchemy import case, func, inspect, text
+
+from . import db
+from .models import Comment, CommentVote
+
+
+def reconcile_comment_likes(fix=True):
+    """
+    So sánh comments.likes với số vote "like" thực tế trong comment_votes.
+    Trả về danh sách (comment_id, likes đang lưu, likes thực tế) bị lệch, sửa lại nếu fix=True.
+    """
+    like_counts = (
+        db.session.query(CommentVote.comment_id, func.count(CommentVote.id).label("likes"))
+        .filter(CommentVote.action == "like")
+        .group_by(CommentVote.comment_id)
+        .subquery()
+    )
+    actual = func.coalesce(like_counts.c.likes, 0)
+    mismatches = (
+        db.session.query(Comment.id, Comment.likes, actual)
+        .outerjoin(like_counts, like_counts.c.comment_id == Comment.id)
+        .filter(func.coalesce(Comment.likes, 0) != actual)
+        .all()
+    )
+
+    if fix and mismatches:
+        # Cập nhật tương đối theo chênh lệch để không ghi đè các vote xảy ra trong lúc đối soát
+        for comment_id, stored, real in mismatches:
+            Comment.query.filter_by(id=comment_id).update(
+                {Comment.likes: func.coalesce(Comment.likes, 0) + (real - (stored or 0))},
+                synchronize_session=False
+            )
+        db.session.commit()
+    return [(comment_id, stored or 0, real) for comment_id, stored, real in mismatches]
+
+
+def backfill_comment_voters():
+    """
+    Nâng cấp comment_votes có từ trước khi thêm cột voter: thêm cột nếu thiếu, điền voter từ
+    user_id / session_id, xóa vote trùng (giữ dòng cũ nhất) rồi mới đặt NOT NULL + unique (comment_id, voter).
+    Trả về (số dòng đã điền voter, số dòng trùng đã xóa).
+    """
+    inspector = inspect(db.engine)
+    if "voter" not in {c["name"] for c in inspector.get_columns("comment_votes")}:
+        db.session.execute(text("ALTER TABLE comment_votes ADD COLUMN voter VARCHAR(120) NULL"))
+
+    filled = CommentVote.query.filter((CommentVote.voter.is_(None)) | (CommentVote.voter == "")).update({
+        CommentVote.voter: case(
+            (CommentVote.user_id.isnot(None), func.concat("user:", CommentVote.user_id)),
+            (CommentVote.session_id.isnot(None), func.concat("session:", CommentVote.session_id)),
+            # Không rõ người vote -> coi mỗi dòng là 1 người riêng
+            else_=func.concat("vote:", CommentVote.id),
+        )
+    }, synchronize_session=False)
+    duplicates = db.session.execute(text(
+        "DELETE v FROM comment_votes v JOIN comment_votes k "
+        "ON k.comment_id = v.comment_id AND k.voter = v.voter AND k.id < v.id"
+    )).rowcount
+    db.session.commit()
+
+    db.session.execute(text("ALTER TABLE comment_votes MODIFY voter VARCHAR(120) NOT NULL"))
+    unique_names = {u["name"] for u in inspector.get_unique_constraints("comment_votes")}
+    if "uq_comment_votes_voter" not in unique_names:
+        db.session.execute(text(
+            "ALTER TABLE comment_votes ADD CONSTRAINT uq_comment_votes_voter UNIQUE (comment_id, voter)"
+        ))
+    db.session.commit()
+    return filled, duplicates